@@ -0,0 +1,19 @@
+import re
+from typing import List, Sequence, Tuple
+
+# One "item: point (Imagery: imagery)" entry; imagery may span several lines
+ENTRY_PATTERN = re.compile(
+    r"^(?P<item>[^:\n]*): (?P<point>[^\n]*?) \(Imagery: ?(?P<imagery>.*?)\)[ \t]*$",
+    re.MULTILINE | re.DOTALL
+)
+
+
+def format_association_content(entries: Sequence[Tuple[str, str, str]]) -> str:
+    """Render (item, point, imagery) entries as the stored association content."""
+    return "".join(f"{item}: {point} (Imagery: {imagery})\n" for item, point, imagery in entries)
+
+
+def parse_association_content(content: str) -> List[Tuple[str, str, str]]:
+    """Recover (item, point, imagery) entries from association content."""
+    return [(match.group("item").strip(), match.group("point").strip(), match.group("imagery").strip())
+            for match in ENTRY_PATTERN.finditer(content or "")]
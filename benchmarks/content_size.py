@@ -0,0 +1,84 @@
+"""Database size and read latency with association content stored plain, compressed and dictionary-compressed.
+
+Run from the repository root:
+
+    python -m benchmarks.content_size --sessions 500
+
+One synthetic database is filled with content stored as plain text, then
+rewritten with zlib and finally with a trained dictionary, vacuuming after each
+stage. Every stage reports the file size, the bytes of content, and the
+p50/p95 of reading a session's associations and of exporting it.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from typing import Dict, List
+
+from benchmarks.run_benchmarks import measure
+from benchmarks.synthetic_data import populate
+from content_compression import recompress_contents, train_content_dictionary
+from database_operations import DatabaseOperations
+
+
+def stage_stats(db_name: str, session_ids: List[str], iterations: int, rng: random.Random) -> Dict:
+    with DatabaseOperations(db_name, session_id=session_ids[0]).connections.connection() as conn:
+        conn.execute("VACUUM")
+        content_bytes = conn.execute("SELECT SUM(LENGTH(content)) FROM associations").fetchone()[0]
+
+    def open_session() -> DatabaseOperations:
+        db = DatabaseOperations(db_name, session_id=rng.choice(session_ids))
+        db.read_cache.clear()
+        return db
+
+    def get_associations():
+        db = open_session()
+        for category_id, _ in db.get_categories():
+            db.get_associations(category_id)
+
+    return {
+        "file_kib": os.path.getsize(db_name) / 1024,
+        "content_kib": content_bytes / 1024,
+        "get_associations": measure(get_associations, iterations),
+        "export_data": measure(lambda: open_session().export_data(), iterations),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=500, help="synthetic sessions to generate")
+    parser.add_argument("--iterations", type=int, default=200, help="samples per read scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as work:
+        db_name = os.path.join(work, "content_size.db")
+        db = DatabaseOperations(db_name, session_id="bench-setup")
+        db.codec.enabled = False
+        session_ids = populate(db_name, args.sessions, seed=args.seed)
+        db.codec.enabled = True
+        results = {"plain": stage_stats(db_name, session_ids, args.iterations, rng)}
+
+        with db.connections.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            recompress_contents(conn, db.codec.decode, 0, b"")
+            conn.commit()
+        results["zlib"] = stage_stats(db_name, session_ids, args.iterations, rng)
+
+        train_content_dictionary(db_name)
+        results["zlib_dictionary"] = stage_stats(db_name, session_ids, args.iterations, rng)
+        db.close()
+
+    print(f"{'stage':<17}{'file KiB':>10}{'content KiB':>13}{'read p50':>10}{'read p95':>10}"
+          f"{'export p50':>12}{'export p95':>12}")
+    for name, stats in results.items():
+        print(f"{name:<17}{stats['file_kib']:>10.0f}{stats['content_kib']:>13.0f}"
+              f"{stats['get_associations']['p50_ms']:>10.2f}{stats['get_associations']['p95_ms']:>10.2f}"
+              f"{stats['export_data']['p50_ms']:>12.2f}{stats['export_data']['p95_ms']:>12.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+import hashlib
+import time
+from typing import Iterator
+
+
+class FakeLLM:
+    """Deterministic stand-in for the OpenAI LLM with a configurable latency.
+
+    Responses depend only on the prompt, so runs are reproducible, and the
+    object exposes the same predict/stream surface the pages use.
+    """
+
+    model_name = "fake-llm"
+
+    def __init__(self, latency: float = 0.05, points: int = 10, temperature: float = 0.6,
+                 chunk_size: int = 8):
+        self.latency = latency
+        self.points = points
+        self.temperature = temperature
+        self.chunk_size = chunk_size
+        self.calls = 0
+
+    def respond(self, prompt: str) -> str:
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        if prompt.startswith("Provide important bullet points about"):
+            return "\n".join(f"- Point {i + 1} ({digest[i:i + 8]})" for i in range(self.points))
+        return f"Imagine {digest[:16]} glowing on the item."
+
+    def predict(self, prompt: str) -> str:
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.respond(prompt)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        self.calls += 1
+        response = self.respond(prompt)
+        chunks = [response[i:i + self.chunk_size] for i in range(0, len(response), self.chunk_size)]
+        for chunk in chunks:
+            time.sleep(self.latency / len(chunks))
+            yield chunk
@@ -0,0 +1,154 @@
+"""Local stand-in for the OpenAI completions endpoint that throttles like a provider.
+
+Run from the repository root:
+
+    python -m benchmarks.fake_llm_server --port 8765 --rpm 600 --max-concurrency 8
+
+and point the app at it with openai_llm(key, base_url="http://127.0.0.1:8765/v1").
+Requests above the per-minute quota or the concurrency cap get a 429, and
+--error-rate injects random 500s, so the client-side limiter can be tested
+without a real provider.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from benchmarks.fake_llm import FakeLLM
+
+
+class FakeProvider:
+    """Quota bookkeeping and responses shared by every request handler."""
+
+    def __init__(self, rpm: float, max_concurrency: int, error_rate: float = 0.0, latency: float = 0.05,
+                 retry_after: Optional[float] = None, seed: int = 0):
+        self.rpm = rpm
+        self.max_concurrency = max_concurrency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.llm = FakeLLM(latency=latency)
+        self.random = random.Random(seed)
+        self.recent = deque()
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.counts = {"ok": 0, "throttled": 0, "errors": 0}
+
+    def admit(self) -> Optional[int]:
+        """Reserve capacity for a request, or return the error status it gets instead."""
+        now = time.monotonic()
+        with self.lock:
+            while self.recent and now - self.recent[0] > 60:
+                self.recent.popleft()
+            if len(self.recent) >= self.rpm or self.in_flight >= self.max_concurrency:
+                self.counts["throttled"] += 1
+                return 429
+            if self.random.random() < self.error_rate:
+                self.counts["errors"] += 1
+                return 500
+            self.recent.append(now)
+            self.in_flight += 1
+            return None
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.counts["ok"] += 1
+
+
+def make_handler(provider: FakeProvider):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status: int, payload: dict, headers: Optional[dict] = None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.endswith("/completions"):
+                self.send_json(404, {"error": {"message": "Not found"}})
+                return
+            status = provider.admit()
+            if status == 429:
+                headers = {"retry-after": str(provider.retry_after)} if provider.retry_after is not None else {}
+                self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, headers)
+                return
+            if status:
+                self.send_json(status, {"error": {"message": "Injected server error", "type": "server_error"}})
+                return
+            try:
+                prompts = request.get("prompt", "")
+                prompts = prompts if isinstance(prompts, list) else [prompts]
+                texts = [provider.llm.predict(prompt) for prompt in prompts]
+                if request.get("stream"):
+                    self.stream(request, texts[0])
+                else:
+                    self.send_json(200, {
+                        "id": "cmpl-fake", "object": "text_completion", "created": int(time.time()),
+                        "model": request.get("model", "fake"),
+                        "choices": [{"text": text, "index": i, "finish_reason": "stop", "logprobs": None}
+                                    for i, text in enumerate(texts)],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                    })
+            finally:
+                provider.release()
+
+        def stream(self, request: dict, text: str):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for start in range(0, len(text), provider.llm.chunk_size):
+                event = {"id": "cmpl-fake", "object": "text_completion", "created": int(time.time()),
+                         "model": request.get("model", "fake"),
+                         "choices": [{"text": text[start:start + provider.llm.chunk_size], "index": 0,
+                                      "finish_reason": None, "logprobs": None}]}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+    return Handler
+
+
+def serve(provider: FakeProvider, port: int = 0) -> ThreadingHTTPServer:
+    """Start the server on a daemon thread and return it; server.server_port holds the bound port."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(provider))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-llm-server", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rpm", type=float, default=600, help="requests accepted per rolling minute")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="requests served at once")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with a 500")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per completion")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds sent with 429s")
+    args = parser.parse_args(argv)
+    provider = FakeProvider(args.rpm, args.max_concurrency, args.error_rate, args.latency, args.retry_after)
+    server = serve(provider, args.port)
+    print(f"Fake LLM server on http://127.0.0.1:{server.server_port}/v1")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(provider.counts)
+
+
+if __name__ == "__main__":
+    main()
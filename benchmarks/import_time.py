@@ -0,0 +1,82 @@
+"""Cold-start and rerun cost of loading the LLM stack, eager versus lazy.
+
+Run from the repository root:
+
+    python -m benchmarks.import_time --iterations 5
+
+cold_start_* time a fresh interpreter importing the page's modules and
+setting up its LLM, the work of the first page load after a restart.
+rerun_* time the LLM setup a rerun repeats inside a warm process. The
+deferred lazy cost is reported as lazy_first_prompt, which only pages that
+actually send a prompt pay.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import textwrap
+from typing import Dict
+
+from benchmarks.run_benchmarks import measure
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APP_IMPORTS = """
+import streamlit, streamlit_tags
+import association_format, database_operations, generation_jobs, llm_cache, llm_operations
+import metrics, retention, semantic_cache, single_flight
+"""
+
+EAGER_SETUP = """
+from langchain_community.llms import OpenAI
+llm = OpenAI(temperature=0.6, openai_api_key="sk-benchmark")
+"""
+
+LAZY_SETUP = """
+llm = llm_operations.openai_llm("sk-benchmark", 0.6)
+"""
+
+
+def run_python(code: str):
+    subprocess.run([sys.executable, "-W", "ignore", "-c", textwrap.dedent(code)], cwd=REPO_ROOT, check=True)
+
+
+def cold_start(setup: str):
+    return lambda: run_python(APP_IMPORTS + setup)
+
+
+def rerun_eager():
+    from langchain_community.llms import OpenAI
+    OpenAI(temperature=0.6, openai_api_key="sk-benchmark")
+
+
+def rerun_lazy():
+    from llm_operations import openai_llm
+    openai_llm("sk-benchmark", 0.6)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5, help="fresh interpreters per cold-start scenario")
+    parser.add_argument("--rerun-iterations", type=int, default=50, help="samples per rerun scenario")
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Dict] = {
+        "python_startup": measure(lambda: run_python("pass"), args.iterations),
+        "cold_start_eager": measure(cold_start(EAGER_SETUP), args.iterations),
+        "cold_start_lazy": measure(cold_start(LAZY_SETUP), args.iterations),
+        "lazy_first_prompt": measure(cold_start(LAZY_SETUP + "llm.llm\n"), args.iterations),
+    }
+    # Warm the imports once so the rerun scenarios only time what a rerun repeats
+    rerun_eager()
+    results["rerun_eager"] = measure(rerun_eager, args.rerun_iterations)
+    results["rerun_lazy"] = measure(rerun_lazy, args.rerun_iterations)
+
+    print(f"{'scenario':<22}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, stats in results.items():
+        print(f"{name:<22}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
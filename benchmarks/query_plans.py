@@ -0,0 +1,114 @@
+"""Check that the hot DatabaseOperations queries are answered from indexes.
+
+Run from the repository root:
+
+    python -m benchmarks.query_plans
+
+Each hot operation runs against a synthetic database while the SQL it
+sends is traced. Every traced query is then run through EXPLAIN QUERY PLAN,
+and any step that scans a whole table instead of searching an index is
+reported. Exits non-zero when one does, so a schema or query change that
+loses an index fails the check. On a few sessions SQLite rightly prefers
+scanning the tiny tables, so keep --sessions at a size where indexes matter.
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.synthetic_data import populate
+from database_operations import DatabaseOperations
+
+# A plan step reading every row of a table; "SCAN t USING INDEX" and virtual table scans walk an index
+FULL_SCAN = re.compile(r"^SCAN (?!.*\bUSING\b)(?!.*VIRTUAL TABLE)(?P<table>\w+)")
+# Table-valued functions and constant rows have nothing to index
+UNINDEXED_SOURCES = {"json_each", "CONSTANT"}
+
+
+def hot_operations(db: DatabaseOperations) -> Dict[str, Callable[[], object]]:
+    palace_id = db.get_palaces()[0][0]
+    category_id = db.get_categories()[0][0]
+    association_id = db.get_association_summaries(category_id)[0][0]
+    return {
+        "get_palaces": db.get_palaces,
+        "get_palace_items": lambda: db.get_palace_items(palace_id),
+        "get_categories": db.get_categories,
+        "get_palace_id": lambda: db.get_palace_id("Palace 0"),
+        "get_associations": lambda: db.get_associations(category_id),
+        "get_association": lambda: db.get_association(association_id),
+        "get_association_entries": lambda: db.get_association_entries(association_id),
+        "get_palace_summaries": db.get_palace_summaries,
+        "get_association_summaries": lambda: db.get_association_summaries(category_id),
+        "search": lambda: db.search("ancient battle"),
+        "export_data": db.export_data,
+        "export_delta": lambda: db.export_delta(db.get_change_token() - 5),
+        "get_delta_json": lambda: db.get_delta_json(0),
+        "import_data": lambda: db.import_data(db.export_data()),
+    }
+
+
+def traced_queries(db: DatabaseOperations, operation: Callable[[], object]) -> List[str]:
+    """The SELECT statements operation sends, with their parameters bound."""
+    statements: List[str] = []
+    with db.connections.connection() as conn:
+        db.read_cache.clear()
+        conn.set_trace_callback(statements.append)
+        try:
+            operation()
+        finally:
+            conn.set_trace_callback(None)
+    # Statements starting with -- are SQLite's own, issued by FTS5 inside a query
+    return list(dict.fromkeys(statement.strip() for statement in statements
+                              if re.match(r"\s*(SELECT|WITH)\b", statement, re.IGNORECASE)))
+
+
+def full_scans(conn: sqlite3.Connection, query: str) -> Tuple[List[str], List[str]]:
+    """The plan of query and the steps in it that scan a whole table."""
+    plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query)]
+    scans = [step for step in plan
+             if (match := FULL_SCAN.match(step)) and match.group("table") not in UNINDEXED_SOURCES]
+    return plan, scans
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100, help="synthetic sessions to generate")
+    parser.add_argument("--verbose", action="store_true", help="print every plan, not only failing ones")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as work:
+        db_name = os.path.join(work, "query_plans.db")
+        session_ids = populate(db_name, args.sessions)
+        db = DatabaseOperations(db_name, session_id=session_ids[0])
+        # Statistics like those retention's PRAGMA optimize keeps, which the planner's choices depend on
+        with db.connections.connection() as conn:
+            conn.execute("ANALYZE")
+            conn.commit()
+        for name, operation in hot_operations(db).items():
+            queries = traced_queries(db, operation)
+            scanning = 0
+            with db.connections.connection() as conn:
+                for query in queries:
+                    plan, scans = full_scans(conn, query)
+                    if scans or args.verbose:
+                        print(f"{name}: {' '.join(query.split())[:100]}")
+                        for step in plan:
+                            print(f"    {'FULL SCAN ' if step in scans else ''}{step}")
+                    scanning += bool(scans)
+            print(f"{name:<28}{len(queries):>3} queries  {'ok' if not scanning else f'{scanning} scanning'}")
+            failures += scanning
+        db.close()
+
+    if failures:
+        print(f"{failures} queries scan a whole table")
+        return 1
+    print("Every hot query uses an index")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""Load test of the LLM rate limiter against the local fake provider.
+
+Run from the repository root:
+
+    python -m benchmarks.rate_limit_load --requests 300 --workers 32 --server-concurrency 8
+
+Many threads send unique imagery prompts through LLMClient at once, the way
+parallel sessions do, first without the limiter and then with it. Each run
+reports completed and failed calls, throughput, the 429s the provider sent
+and the p95 latency of completed calls.
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from benchmarks.fake_llm_server import FakeProvider, serve
+from benchmarks.run_benchmarks import percentile
+from llm_operations import LLMClient, build_imagery_prompt, openai_llm
+from rate_limit import RateLimiter
+from single_flight import SingleFlight
+
+
+def run_load(args, limiter: Optional[RateLimiter]) -> Dict:
+    provider = FakeProvider(args.server_rpm, args.server_concurrency, args.error_rate, args.latency)
+    server = serve(provider)
+    client = LLMClient(openai_llm("sk-benchmark", base_url=f"http://127.0.0.1:{server.server_port}/v1"),
+                       flights=SingleFlight(), limiter=limiter)
+    latencies, failures = [], 0
+
+    def call(index: int):
+        started = time.perf_counter()
+        client.predict(build_imagery_prompt(f"item {index}", f"point {index}"))
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for future in [executor.submit(call, i) for i in range(args.requests)]:
+            try:
+                latencies.append(future.result())
+            except Exception:
+                failures += 1
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+    return {
+        "completed": len(latencies),
+        "failed": failures,
+        "per_s": round(len(latencies) / elapsed, 2),
+        "throttled": provider.counts["throttled"],
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        "limit": limiter.stats()["limit"] if limiter else None,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=32, help="threads sending requests at once")
+    parser.add_argument("--server-rpm", type=float, default=100000, help="provider requests per minute")
+    parser.add_argument("--server-concurrency", type=int, default=8, help="provider requests served at once")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="fraction of provider 500s")
+    parser.add_argument("--latency", type=float, default=0.05, help="provider seconds per completion")
+    parser.add_argument("--deadline", type=float, default=30.0, help="limiter deadline per call")
+    args = parser.parse_args(argv)
+
+    results = {
+        "no_limiter": run_load(args, None),
+        "limiter": run_load(args, RateLimiter(deadline=args.deadline, max_in_flight=args.workers)),
+    }
+    print(f"{'run':<12}{'completed':>11}{'failed':>8}{'per s':>9}{'429s':>7}{'p95 ms':>9}{'limit':>7}")
+    for name, stats in results.items():
+        print(f"{name:<12}{stats['completed']:>11}{stats['failed']:>8}{stats['per_s']:>9}{stats['throttled']:>7}"
+              f"{stats['p95_ms'] or '-':>9}{stats['limit'] or '-':>7}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""Benchmarks for DatabaseOperations and the association generation pipeline.
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks --sessions 2000 --save-baseline
+    python -m benchmarks.run_benchmarks --sessions 2000 --compare
+
+Every scenario reports p50/p95 latency and throughput. --save-baseline writes
+the results to the baseline file and --compare exits non-zero when a
+scenario's p95 is slower than the baseline by more than --tolerance (and by
+at least --min-delta-ms).
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from association_format import format_association_content
+from benchmarks.fake_llm import FakeLLM
+from benchmarks.synthetic_data import make_session_data, populate
+from database_operations import DatabaseOperations
+from llm_operations import (MAX_CONCURRENT_REQUESTS, build_topic_prompt, generate_imagery_results,
+                            parse_bullet_points)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(operation: Callable[[], None], iterations: int) -> Dict[str, float]:
+    """Time operation iterations times and summarise the latencies in milliseconds."""
+    samples = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        operation()
+        samples.append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - started
+    return {
+        "p50_ms": round(percentile(samples, 0.50), 3),
+        "p95_ms": round(percentile(samples, 0.95), 3),
+        "ops_per_s": round(iterations / elapsed, 2),
+        "iterations": iterations,
+    }
+
+
+def database_scenarios(db_name: str, session_ids: List[str], rng: random.Random) -> Dict[str, Callable[[], None]]:
+    def open_session() -> DatabaseOperations:
+        db = DatabaseOperations(db_name, session_id=rng.choice(session_ids))
+        # Measure SQL, not the session read cache
+        db.read_cache.clear()
+        return db
+
+    def add_items():
+        db = open_session()
+        palace_id = db.add_palace(f"bench palace {rng.random()}")
+        db.add_items(palace_id, [f"item {i}" for i in range(10)])
+
+    def get_palaces():
+        open_session().get_palaces()
+
+    def get_associations():
+        db = open_session()
+        for category_id, _ in db.get_categories():
+            db.get_associations(category_id)
+
+    def list_pages():
+        # What the paginated tabs read per rerun: a page of palaces and topics, then one association
+        db = open_session()
+        db.get_palace_summaries()
+        for category_id, _ in db.get_categories():
+            summaries = db.get_association_summaries(category_id)
+            if summaries:
+                db.get_association(summaries[0][0])
+
+    def export_data():
+        open_session().export_data()
+
+    def import_data():
+        db = DatabaseOperations(db_name, session_id=f"bench-import-{rng.random()}")
+        db.import_data(make_session_data(rng))
+
+    return {
+        "add_items": add_items,
+        "get_palaces": get_palaces,
+        "get_associations": get_associations,
+        "list_pages": list_pages,
+        "export_data": export_data,
+        "import_data": import_data,
+    }
+
+
+def generation_scenario(db_name: str, llm: FakeLLM, max_workers: int, rng: random.Random) -> Callable[[], None]:
+    """One "Generate Associations" click: topic points, imagery per item, then the database writes."""
+    def generate():
+        db = DatabaseOperations(db_name, session_id=f"bench-generate-{rng.random()}")
+        topic = f"Topic {rng.random()}"
+        items = [f"item {i}" for i in range(10)]
+        points = parse_bullet_points(llm.predict(build_topic_prompt(topic)))
+        results = generate_imagery_results(items, points, llm, max_workers)
+        entries = [(item, point, imagery or "") for item, point, (imagery, _) in zip(items, points, results)]
+        palace_id = db.add_palace("Generated palace")
+        db.add_items(palace_id, items)
+        category_id = db.add_category("Generated")
+        db.save_association(topic, category_id, palace_id, format_association_content(entries), entries)
+
+    return generate
+
+
+def concurrent_writes_scenario(db_name: str, write_behind: bool, sessions: int,
+                               rng: random.Random) -> Callable[[], None]:
+    """The database writes of one "Generate Associations" click, from several sessions at once."""
+    def click(session_id: str):
+        db = DatabaseOperations(db_name, session_id=session_id, write_behind=write_behind)
+        items = [f"item {i}" for i in range(10)]
+        entries = [(item, f"point {i}", f"imagery {i}") for i, item in enumerate(items)]
+        palace_id = db.add_palace("Generated palace")
+        db.add_items(palace_id, items)
+        category_id = db.add_category("Generated")
+        db.save_association("Topic", category_id, palace_id, format_association_content(entries), entries)
+
+    def clicks():
+        with ThreadPoolExecutor(max_workers=sessions) as executor:
+            list(executor.map(click, [f"bench-writes-{rng.random()}" for _ in range(sessions)]))
+
+    return clicks
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float, min_delta_ms: float) -> List[str]:
+    regressions = []
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        limit = baseline[name]["p95_ms"]
+        # Sub-millisecond scenarios are too noisy for a purely relative threshold
+        if stats["p95_ms"] > limit * (1 + tolerance) and stats["p95_ms"] - limit > min_delta_ms:
+            regressions.append(f"{name}: p95 {stats['p95_ms']}ms vs baseline {baseline[name]['p95_ms']}ms")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=1000, help="synthetic sessions to generate")
+    parser.add_argument("--iterations", type=int, default=200, help="samples per database scenario")
+    parser.add_argument("--generate-iterations", type=int, default=20, help="samples per generation scenario")
+    parser.add_argument("--write-sessions", type=int, default=16, help="sessions writing at once")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="fake LLM latency per call in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="fail when slower than the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative p95 slowdown before failing")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore p95 slowdowns smaller than this")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        db_name = os.path.join(workdir, "bench.db")
+        started = time.perf_counter()
+        session_ids = populate(db_name, args.sessions, seed=args.seed)
+        print(f"Generated {args.sessions} sessions in {time.perf_counter() - started:.1f}s")
+
+        results = {}
+        for name, operation in database_scenarios(db_name, session_ids, rng).items():
+            results[name] = measure(operation, args.iterations)
+
+        llm = FakeLLM(latency=args.llm_latency)
+        results["generate_sequential"] = measure(generation_scenario(db_name, llm, 1, rng), args.generate_iterations)
+        results["generate_concurrent"] = measure(generation_scenario(db_name, llm, MAX_CONCURRENT_REQUESTS, rng),
+                                                 args.generate_iterations)
+        for name, write_behind in (("concurrent_writes", False), ("concurrent_writes_grouped", True)):
+            results[name] = measure(concurrent_writes_scenario(db_name, write_behind, args.write_sessions, rng),
+                                    args.generate_iterations)
+
+    print(f"{'scenario':<26}{'p50 ms':>10}{'p95 ms':>10}{'ops/s':>10}")
+    for name, stats in results.items():
+        print(f"{name:<26}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['ops_per_s']:>10.2f}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+    if args.compare:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_delta_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import random
+from typing import Dict, List
+
+from association_format import format_association_content
+from database_operations import DatabaseOperations
+
+WORDS = ("ancient battle treaty empire river mountain signal engine harbor crown "
+         "letter winter garden market bridge tower lantern compass mirror orchard").split()
+ITEMS = ("Door Desk Lamp Mirror Sofa Window Rug Shelf Clock Plant "
+         "Bed Chair Table Photo Vase Stove Sink Fridge Oven Closet").split()
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def make_session_data(rng: random.Random, palaces: int = 5, items_per_palace: int = 10,
+                      categories: int = 3, associations_per_category: int = 20) -> Dict:
+    """Build one session's data in the export_data/import_data format."""
+    palace_list = []
+    for p in range(palaces):
+        items = rng.sample(ITEMS, items_per_palace)
+        palace_list.append({"name": f"Palace {p}", "items": items})
+
+    category_list = []
+    for c in range(categories):
+        associations = []
+        for a in range(associations_per_category):
+            palace = rng.choice(palace_list)
+            entries = [(item, _sentence(rng, 12), _sentence(rng, 25)) for item in palace["items"]]
+            associations.append({
+                "topic": f"Topic {c}-{a} {rng.choice(WORDS)}",
+                "palace_name": palace["name"],
+                "content": format_association_content(entries)
+            })
+        category_list.append({"name": f"Category {c}", "associations": associations})
+
+    return {"palaces": palace_list, "categories": category_list, "associations": []}
+
+
+def populate(db_name: str, sessions: int, seed: int = 0, **session_options) -> List[str]:
+    """Fill db_name with synthetic sessions and return their session ids."""
+    rng = random.Random(seed)
+    session_ids = []
+    for s in range(sessions):
+        session_id = f"bench-{seed}-{s}"
+        DatabaseOperations(db_name, session_id=session_id).import_data(make_session_data(rng, **session_options))
+        session_ids.append(session_id)
+    return session_ids
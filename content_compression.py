@@ -0,0 +1,195 @@
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from db_connection import get_connection_manager
+
+# Store new association content compressed; rows already compressed stay readable either way
+COMPRESS_CONTENT = os.environ.get("MEMORY_PALACE_COMPRESS_CONTENT", "1").lower() in ("1", "true", "yes")
+COMPRESSION_LEVEL = 6
+# Compressed content is a BLOB starting with the format version and the id of the dictionary
+# it was compressed with (0 for none), followed by raw deflate data. Plain TEXT is uncompressed.
+HEADER = struct.Struct(">BI")
+FORMAT_VERSION = 1
+# deflate only looks back 32 KiB, so a larger dictionary would never be used
+DICTIONARY_SIZE = 32 * 1024
+# Rows sampled to train a dictionary, and the fewest worth training on
+TRAINING_SAMPLES = 2000
+MIN_TRAINING_SAMPLES = 50
+# Words per candidate segment when training
+SEGMENT_WORDS = 4
+
+StoredContent = Union[str, bytes]
+
+
+def train_dictionary(samples: Iterable[str], size: int = DICTIONARY_SIZE) -> bytes:
+    """Build a deflate dictionary from the word segments shared by the most samples.
+
+    A small stand-in for zstd's dictionary trainer: segments of SEGMENT_WORDS
+    words are ranked by how many samples contain them times their length, and
+    the best are packed up to size bytes. The most valuable go last, since
+    deflate encodes nearer matches in fewer bits.
+    """
+    counts: Counter = Counter()
+    for sample in samples:
+        tokens = re.findall(r"\S+\s*", sample)
+        counts.update({"".join(tokens[i:i + SEGMENT_WORDS]) for i in range(len(tokens) - SEGMENT_WORDS + 1)})
+
+    chosen: List[str] = []
+    total = 0
+    for segment, count in sorted(counts.items(), key=lambda pair: pair[1] * len(pair[0]), reverse=True):
+        if count < 2 or total >= size:
+            break
+        chosen.append(segment)
+        total += len(segment.encode("utf-8"))
+    return "".join(reversed(chosen)).encode("utf-8")[-size:]
+
+
+class ContentCodec:
+    """Compresses association content with the newest dictionary of a database.
+
+    Dictionaries live in the content_dictionaries table and are never changed
+    once stored, so a blob always decompresses with the dictionary it names.
+    A codec that meets an id it does not know reloads the table, which picks up
+    dictionaries trained by other processes.
+    """
+
+    def __init__(self, db_name: str, enabled: bool = COMPRESS_CONTENT, level: int = COMPRESSION_LEVEL):
+        self.connections = get_connection_manager(db_name)
+        self.enabled = enabled
+        self.level = level
+        self.dictionaries: Dict[int, bytes] = {0: b""}
+        self.lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        with self.connections.connection() as conn:
+            rows = conn.execute("SELECT id, dictionary FROM content_dictionaries").fetchall()
+        with self.lock:
+            self.dictionaries.update(rows)
+
+    @property
+    def current(self) -> int:
+        with self.lock:
+            return max(self.dictionaries)
+
+    def _dictionary(self, dictionary_id: int) -> bytes:
+        with self.lock:
+            dictionary = self.dictionaries.get(dictionary_id)
+        if dictionary is None:
+            self.reload()
+            with self.lock:
+                dictionary = self.dictionaries.get(dictionary_id)
+            if dictionary is None:
+                raise ValueError(f"Unknown content dictionary {dictionary_id}")
+        return dictionary
+
+    def encode(self, content: str) -> StoredContent:
+        """Return content as it should be stored: a compressed blob, or the text itself when that is smaller."""
+        if not self.enabled or not content:
+            return content
+        dictionary_id = self.current
+        return compress(content, dictionary_id, self._dictionary(dictionary_id), self.level)
+
+    def decode(self, stored: Optional[StoredContent]) -> Optional[str]:
+        """Return the text of a stored content value, compressed or not."""
+        if not isinstance(stored, bytes):
+            return stored
+        version, dictionary_id = HEADER.unpack_from(stored)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported content format {version}")
+        return decompress(stored, self._dictionary(dictionary_id))
+
+    def register(self, dictionary_id: int, dictionary: bytes):
+        """Use a dictionary committed by this process for new content without reloading the table."""
+        with self.lock:
+            self.dictionaries[dictionary_id] = dictionary
+
+
+def compress(content: str, dictionary_id: int, dictionary: bytes, level: int = COMPRESSION_LEVEL) -> StoredContent:
+    """Compress content into a header-prefixed blob, or return it unchanged when that is no smaller."""
+    data = content.encode("utf-8")
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary) if dictionary else \
+        zlib.compressobj(level, zlib.DEFLATED, -15)
+    blob = HEADER.pack(FORMAT_VERSION, dictionary_id) + compressor.compress(data) + compressor.flush()
+    return blob if len(blob) < len(data) else content
+
+
+def decompress(blob: bytes, dictionary: bytes) -> str:
+    decompressor = zlib.decompressobj(-15, zdict=dictionary) if dictionary else zlib.decompressobj(-15)
+    return (decompressor.decompress(blob[HEADER.size:]) + decompressor.flush()).decode("utf-8")
+
+
+def store_dictionary(conn: sqlite3.Connection, dictionary: bytes, samples: int) -> int:
+    return conn.execute("INSERT INTO content_dictionaries (dictionary, samples, trained_at) VALUES (?, ?, ?)",
+                        (dictionary, samples, time.time())).lastrowid
+
+
+def sample_contents(conn: sqlite3.Connection, decode: Callable[[StoredContent], str],
+                    limit: int = TRAINING_SAMPLES) -> List[str]:
+    """Text of the newest associations, which are the most like what will be written next."""
+    rows = conn.execute("SELECT content FROM associations ORDER BY id DESC LIMIT ?", (limit,))
+    return [content for content in (decode(row[0]) for row in rows) if content]
+
+
+def recompress_contents(conn: sqlite3.Connection, decode: Callable[[StoredContent], str], dictionary_id: int,
+                        dictionary: bytes, batch_size: int = 500) -> int:
+    """Rewrite every association's content compressed with a dictionary and return the rows rewritten."""
+    rewritten = 0
+    last_id = 0
+    while True:
+        rows = conn.execute("SELECT id, content FROM associations WHERE id > ? ORDER BY id LIMIT ?",
+                            (last_id, batch_size)).fetchall()
+        if not rows:
+            return rewritten
+        conn.executemany("UPDATE associations SET content = ? WHERE id = ?",
+                         [(compress(text, dictionary_id, dictionary) if text else text, association_id)
+                          for association_id, text in ((row[0], decode(row[1])) for row in rows)])
+        rewritten += len(rows)
+        last_id = rows[-1][0]
+
+
+def train_content_dictionary(db_name: str = "memory_palace.db", recompress: bool = True) -> Optional[int]:
+    """Train a dictionary on the newest content of db_name and use it for new writes.
+
+    With recompress, existing rows are rewritten with it in the same
+    transaction. Returns the new dictionary id, or None when there are too few
+    associations to train on.
+    """
+    codec = get_content_codec(db_name)
+    with get_connection_manager(db_name).connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            samples = sample_contents(conn, codec.decode)
+            if len(samples) < MIN_TRAINING_SAMPLES:
+                conn.rollback()
+                return None
+            dictionary = train_dictionary(samples)
+            dictionary_id = store_dictionary(conn, dictionary, len(samples))
+            if recompress:
+                recompress_contents(conn, codec.decode, dictionary_id, dictionary)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    codec.register(dictionary_id, dictionary)
+    return dictionary_id
+
+
+_codecs: Dict[str, ContentCodec] = {}
+_codecs_lock = threading.Lock()
+
+
+def get_content_codec(db_name: str = "memory_palace.db") -> ContentCodec:
+    """Return the process-wide content codec for db_name."""
+    key = os.path.abspath(db_name)
+    with _codecs_lock:
+        if key not in _codecs:
+            _codecs[key] = ContentCodec(db_name)
+        return _codecs[key]
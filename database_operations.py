@@ -1,21 +1,97 @@
 import sqlite3
-from typing import List, Tuple, Dict
+from itertools import groupby
+from operator import itemgetter
+from typing import Any, Callable, Iterator, List, Optional, Tuple, Dict
 import streamlit as st
 import uuid
 import json
 import os
+import re
+import threading
+import time
+from association_format import parse_association_content
+from content_compression import ContentCodec, get_content_codec
+from db_connection import get_connection_manager, with_connection
+from db_migrations import apply_migrations, session_search_token
+from metrics import timed
+from read_cache import get_session_cache
+from write_behind import WRITE_BEHIND, WriteBehindQueue, get_write_queue
+
+# Rows per executemany call when importing, so progress can be reported on large uploads
+IMPORT_BATCH_SIZE = 500
+
+# Rows per page of the summary listings
+PAGE_SIZE = 25
+
+
+# Seconds between last-activity writes for the same session
+SESSION_TOUCH_INTERVAL = 60
+
+# Databases whose schema is already up to date in this process
+_initialized_databases = set()
+_initialized_lock = threading.Lock()
+_session_touches: Dict[Tuple[str, str], float] = {}
 
 
 class DatabaseOperations:
-    def __init__(self, db_name: str = "memory_palace.db"):
-        self.conn = sqlite3.connect(db_name)
-        self.cursor = self.conn.cursor()
-        self.create_tables()
+    def __init__(self, db_name: str = "memory_palace.db", session_id: Optional[str] = None,
+                 write_behind: bool = WRITE_BEHIND):
+        """Open db_name for a session.
+
+        session_id defaults to the Streamlit session's id; pass one explicitly
+        to use the class outside a Streamlit script run. With write_behind the
+        single-row writes are committed in groups by the process-wide writer
+        thread; each method still returns only once its write is committed.
+        """
+        self.db_name = db_name
+        self.connections = get_connection_manager(db_name)
+        self.writer: Optional[WriteBehindQueue] = get_write_queue(db_name) if write_behind else None
+        with _initialized_lock:
+            if os.path.abspath(db_name) not in _initialized_databases:
+                self.create_tables()
+                _initialized_databases.add(os.path.abspath(db_name))
+        # Association content is stored compressed; every read and write of it goes through the codec
+        self.codec: ContentCodec = get_content_codec(db_name)
+
+        if session_id is None:
+            if 'session_id' not in st.session_state:
+                st.session_state.session_id = str(uuid.uuid4())
+            session_id = st.session_state.session_id
+        self.session_id = session_id
+        self.read_cache = get_session_cache(db_name, self.session_id)
+        self.touch_session()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The connection borrowed by the running with_connection method."""
+        return self.connections.current().conn
+
+    @property
+    def cursor(self) -> sqlite3.Cursor:
+        return self.connections.current().cursor
+
+    def _write(self, write: Callable[[], Any]) -> Any:
+        """Run write in its own transaction and return its result once committed.
 
-        if 'session_id' not in st.session_state:
-            st.session_state.session_id = str(uuid.uuid4())
-        self.session_id = st.session_state.session_id
+        write must not return a cursor: with write-behind it belongs to the
+        writer thread's connection, so return lastrowid or rowcount instead.
 
+        Write methods borrow no connection while they wait: the writer thread
+        has its own, so callers queued on it never drain the pool.
+        """
+        if self.writer is not None:
+            return self.writer.submit(write).result()
+        with self.connections.connection() as conn:
+            try:
+                result = write()
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return result
+
+    @timed("db.create_tables")
+    @with_connection
     def create_tables(self):
         self.cursor.execute('''
         CREATE TABLE IF NOT EXISTS palaces (
@@ -58,120 +134,545 @@ class DatabaseOperations:
         ''')
 
         self.conn.commit()
+        apply_migrations(self.conn)
+
+    def touch_session(self):
+        """Record activity for the session so retention keeps its rows; throttled per process."""
+        key = (os.path.abspath(self.db_name), self.session_id)
+        now = time.time()
+        if now - _session_touches.get(key, 0) < SESSION_TOUCH_INTERVAL:
+            return
+        _session_touches[key] = now
+        self._write(lambda: self.conn.execute("""
+        INSERT INTO sessions (session_id, last_active) VALUES (?, ?)
+        ON CONFLICT(session_id) DO UPDATE SET last_active = excluded.last_active
+        """, (self.session_id, now)).rowcount)
 
+    @timed("db.add_palace")
     def add_palace(self, name: str) -> int:
+        display_name = name
+        namespaced_name = f"{self.session_id}_{name}"
         try:
-            display_name = name
-            namespaced_name = f"{self.session_id}_{name}"
-            self.cursor.execute("INSERT INTO palaces (session_id, name, display_name) VALUES (?, ?, ?)",
-                                (self.session_id, namespaced_name, display_name))
-            self.conn.commit()
-            return self.cursor.lastrowid
+            palace_id = self._write(lambda: self.conn.execute(
+                "INSERT INTO palaces (session_id, name, display_name) VALUES (?, ?, ?)",
+                (self.session_id, namespaced_name, display_name)).lastrowid)
         except sqlite3.IntegrityError:
             return None
+        self.read_cache.invalidate("palaces", "export_json")
+        return palace_id
 
+    @timed("db.add_items")
     def add_items(self, palace_id: int, items: List[str]):
-        for item in items:
-            self.cursor.execute("INSERT INTO items (palace_id, item_name) VALUES (?, ?)", (palace_id, item))
-        self.conn.commit()
+        self._write(lambda: self.conn.executemany("INSERT INTO items (palace_id, item_name) VALUES (?, ?)",
+                                                  [(palace_id, item) for item in items]).rowcount)
+        self.read_cache.invalidate(("items", palace_id), "export_json")
 
+    @timed("db.get_palaces")
     def get_palaces(self) -> List[Tuple[int, str]]:
-        self.cursor.execute("SELECT id, display_name FROM palaces WHERE session_id = ?", (self.session_id,))
+        return self.read_cache.get_or_load("palaces", self._load_palaces)
+
+    @with_connection
+    def _load_palaces(self) -> List[Tuple[int, str]]:
+        self.cursor.execute("SELECT id, display_name FROM palaces WHERE session_id = ? ORDER BY id",
+                            (self.session_id,))
         return self.cursor.fetchall()
 
+    @timed("db.get_palace_map")
+    def get_palace_map(self) -> Dict[int, str]:
+        """Map palace id to display name for the current session."""
+        return dict(self.get_palaces())
+
+    @timed("db.get_palace_items")
     def get_palace_items(self, palace_id: int) -> List[str]:
-        self.cursor.execute("SELECT item_name FROM items WHERE palace_id = ?", (palace_id,))
+        return self.read_cache.get_or_load(("items", palace_id), lambda: self._load_palace_items(palace_id))
+
+    @with_connection
+    def _load_palace_items(self, palace_id: int) -> List[str]:
+        self.cursor.execute("SELECT item_name FROM items WHERE palace_id = ? ORDER BY id", (palace_id,))
         return [item[0] for item in self.cursor.fetchall()]
 
+    @timed("db.add_category")
     def add_category(self, name: str) -> int:
+        namespaced_name = f"{self.session_id}_{name}"
         try:
-            namespaced_name = f"{self.session_id}_{name}"
-            self.cursor.execute("INSERT INTO categories (session_id, name) VALUES (?, ?)",
-                                (self.session_id, namespaced_name))
-            self.conn.commit()
-            return self.cursor.lastrowid
+            category_id = self._write(lambda: self.conn.execute(
+                "INSERT INTO categories (session_id, name) VALUES (?, ?)",
+                (self.session_id, namespaced_name)).lastrowid)
         except sqlite3.IntegrityError:
             return None
+        self.read_cache.invalidate("categories", "export_json")
+        return category_id
 
+    @timed("db.get_categories")
     def get_categories(self) -> List[Tuple[int, str]]:
-        self.cursor.execute("SELECT id, name FROM categories WHERE session_id = ?", (self.session_id,))
+        return self.read_cache.get_or_load("categories", self._load_categories)
+
+    @with_connection
+    def _load_categories(self) -> List[Tuple[int, str]]:
+        self.cursor.execute("SELECT id, name FROM categories WHERE session_id = ? ORDER BY id", (self.session_id,))
         categories = self.cursor.fetchall()
         # Remove the session_id prefix from the category names before returning
         return [(cat_id, name.split('_', 1)[1]) for cat_id, name in categories]
 
-    def save_association(self, topic: str, category_id: int, palace_id: int, content: str) -> int:
-        self.cursor.execute("""
-        INSERT INTO associations (topic, category_id, palace_id, content)
-        VALUES (?, ?, ?, ?)
-        """, (topic, category_id, palace_id, content))
-        self.conn.commit()
-        return self.cursor.lastrowid
+    @timed("db.save_association")
+    def save_association(self, topic: str, category_id: int, palace_id: int, content: str,
+                         entries: Optional[List[Tuple[str, str, str]]] = None,
+                         on_saved: Optional[Callable[[sqlite3.Connection, int], None]] = None) -> int:
+        """Save an association and its (item, point, imagery) entries.
 
-    def get_associations(self, category_id: int) -> List[Tuple[int, str, int, str]]:
+        When entries is not given they are parsed from content. on_saved(conn,
+        association_id) runs in the same transaction, so what it writes commits
+        or rolls back together with the association.
+        """
+        if entries is None:
+            entries = parse_association_content(content)
+        # Compressed here rather than in insert, so the writer thread only runs SQL
+        stored = self.codec.encode(content)
+
+        def insert():
+            association_id = self.conn.execute("""
+            INSERT INTO associations (topic, category_id, palace_id, content)
+            VALUES (?, ?, ?, ?)
+            """, (topic, category_id, palace_id, stored)).lastrowid
+            self._insert_entries([(association_id, entries)])
+            if on_saved is not None:
+                on_saved(self.conn, association_id)
+            return association_id
+
+        association_id = self._write(insert)
+        self.read_cache.invalidate(("associations", category_id), "export_json")
+        return association_id
+
+    @timed("db.save_associations")
+    def save_associations(self, associations: List[Tuple[str, int, int, str, List[Tuple[str, str, str]]]],
+                          on_saved: Optional[Callable[[sqlite3.Connection, List[int]], None]] = None) -> List[int]:
+        """Save (topic, category_id, palace_id, content, entries) associations in one transaction.
+
+        on_saved(conn, association_ids) runs in that transaction, as with save_association.
+        """
+        stored = [self.codec.encode(association[3]) for association in associations]
+
+        def insert():
+            association_ids = []
+            for (topic, category_id, palace_id, _, _), content in zip(associations, stored):
+                association_id = self.conn.execute("""
+                INSERT INTO associations (topic, category_id, palace_id, content)
+                VALUES (?, ?, ?, ?)
+                """, (topic, category_id, palace_id, content)).lastrowid
+                association_ids.append(association_id)
+            self._insert_entries([(association_id, association[4])
+                                  for association_id, association in zip(association_ids, associations)])
+            if on_saved is not None:
+                on_saved(self.conn, association_ids)
+            return association_ids
+
+        association_ids = self._write(insert)
+        self.read_cache.invalidate(*{("associations", association[1]) for association in associations},
+                                   "export_json")
+        return association_ids
+
+    @with_connection
+    def _insert_entries(self, associations: List[Tuple[int, List[Tuple[str, str, str]]]]):
+        self.conn.executemany("""
+        INSERT INTO association_entries (association_id, position, item, point, imagery)
+        VALUES (?, ?, ?, ?, ?)
+        """, [(association_id, position, item, point, imagery)
+              for association_id, entries in associations
+              for position, (item, point, imagery) in enumerate(entries)])
+
+    @timed("db.get_associations")
+    def get_associations(self, category_id: int) -> List[Tuple[int, str, int, str, List[Tuple[str, str, str]]]]:
+        """Return (id, topic, palace_id, content, entries) for every association in a category."""
+        return self.read_cache.get_or_load(("associations", category_id),
+                                           lambda: self._load_associations(category_id))
+
+    @with_connection
+    def _load_associations(self, category_id: int) -> List[Tuple[int, str, int, str, List[Tuple[str, str, str]]]]:
         self.cursor.execute("""
         SELECT id, topic, palace_id, content
         FROM associations
         WHERE category_id = ?
         """, (category_id,))
+        associations = [(association_id, topic, palace_id, self.codec.decode(content))
+                        for association_id, topic, palace_id, content in self.cursor.fetchall()]
+
+        entries = {}
+        for association_id, item, point, imagery in self.conn.execute("""
+        SELECT e.association_id, e.item, e.point, e.imagery
+        FROM associations a
+        JOIN association_entries e ON e.association_id = a.id
+        WHERE a.category_id = ?
+        ORDER BY e.association_id, e.position
+        """, (category_id,)):
+            entries.setdefault(association_id, []).append((item, point, imagery))
+        return [assoc + (entries.get(assoc[0], []),) for assoc in associations]
+
+    @timed("db.get_association_entries")
+    @with_connection
+    def get_association_entries(self, association_id: int) -> List[Tuple[str, str, str]]:
+        self.cursor.execute("""
+        SELECT item, point, imagery
+        FROM association_entries
+        WHERE association_id = ?
+        ORDER BY position
+        """, (association_id,))
         return self.cursor.fetchall()
 
+    @timed("db.get_palace_summaries")
+    @with_connection
+    def get_palace_summaries(self, after_id: int = 0, limit: int = PAGE_SIZE) -> List[Tuple[int, str, int]]:
+        """Return (id, display_name, item_count) for up to limit palaces with an id above after_id.
+
+        Pass the last id of one page as after_id to get the next, so every page
+        costs the same however many palaces the session has.
+        """
+        self.cursor.execute("""
+        SELECT p.id, p.display_name, (SELECT COUNT(*) FROM items i WHERE i.palace_id = p.id)
+        FROM palaces p
+        WHERE p.session_id = ? AND p.id > ?
+        ORDER BY p.id
+        LIMIT ?
+        """, (self.session_id, after_id, limit))
+        return self.cursor.fetchall()
+
+    @timed("db.get_association_summaries")
+    @with_connection
+    def get_association_summaries(self, category_id: int, after_id: int = 0,
+                                  limit: int = PAGE_SIZE) -> List[Tuple[int, str, int, int]]:
+        """Return (id, topic, palace_id, entry_count) for up to limit associations with an id above after_id.
+
+        Content and entries are left out; load them with get_association for the one being shown.
+        """
+        self.cursor.execute("""
+        SELECT a.id, a.topic, a.palace_id,
+               (SELECT COUNT(*) FROM association_entries e WHERE e.association_id = a.id)
+        FROM associations a
+        WHERE a.category_id = ? AND a.id > ?
+        ORDER BY a.id
+        LIMIT ?
+        """, (category_id, after_id, limit))
+        return self.cursor.fetchall()
+
+    @timed("db.get_association")
+    @with_connection
+    def get_association(self, association_id: int) -> Optional[Tuple[int, str, int, str, List[Tuple[str, str, str]]]]:
+        """Return (id, topic, palace_id, content, entries) for one of the session's associations, or None."""
+        self.cursor.execute("""
+        SELECT a.id, a.topic, a.palace_id, a.content
+        FROM associations a
+        JOIN categories c ON c.id = a.category_id
+        WHERE a.id = ? AND c.session_id = ?
+        """, (association_id, self.session_id))
+        association = self.cursor.fetchone()
+        if association is None:
+            return None
+        return association[:3] + (self.codec.decode(association[3]), self.get_association_entries(association_id))
+
+    @timed("db.search")
+    @with_connection
+    def search(self, query: str, limit: int = 20) -> List[Tuple[int, str, str, str, str]]:
+        """Full-text search over the session's topics, palace items, points and imagery.
+
+        Returns (association_id, topic, category_name, item, snippet) for the best
+        matching entries, most relevant first. Matches are wrapped in ** in the snippet.
+        """
+        terms = re.findall(r"\w+", query)
+        if not terms:
+            return []
+        # Quote every term so user input is never parsed as FTS syntax; the last one matches as a prefix.
+        # The session term keeps the index from matching and ranking other sessions' rows.
+        phrases = " ".join(f'"{term}"' for term in terms) + "*"
+        match = f'session : "{session_search_token(self.session_id)}" AND {{topic item point imagery}} : ({phrases})'
+        self.cursor.execute("""
+        SELECT e.association_id, a.topic, c.name, e.item,
+               snippet(association_search, -1, '**', '**', '...', 12)
+        FROM association_search
+        JOIN association_entries e ON e.id = association_search.rowid
+        JOIN associations a ON a.id = e.association_id
+        JOIN categories c ON c.id = a.category_id
+        WHERE association_search MATCH ? AND c.session_id = ?
+        ORDER BY rank
+        LIMIT ?
+        """, (match, self.session_id, limit))
+        return [(association_id, topic, category_name.split('_', 1)[1], item, snippet)
+                for association_id, topic, category_name, item, snippet in self.cursor.fetchall()]
+
+    def _export_palace_rows(self) -> sqlite3.Cursor:
+        return self.conn.execute("""
+        SELECT p.id, p.display_name, i.item_name
+        FROM palaces p
+        LEFT JOIN items i ON i.palace_id = p.id
+        WHERE p.session_id = ?
+        ORDER BY p.id, i.id
+        """, (self.session_id,))
+
+    def _export_category_rows(self) -> sqlite3.Cursor:
+        return self.conn.execute("""
+        SELECT c.id, c.name, a.id, a.topic, p.display_name, a.content
+        FROM categories c
+        LEFT JOIN associations a ON a.category_id = c.id
+        LEFT JOIN palaces p ON p.id = a.palace_id
+        WHERE c.session_id = ?
+        ORDER BY c.id, a.id
+        """, (self.session_id,))
+
+    def _iter_export_palaces(self) -> Iterator[Dict]:
+        for (_, palace_name), rows in groupby(self._export_palace_rows(), key=itemgetter(0, 1)):
+            yield {
+                "name": palace_name,
+                "items": [row[2] for row in rows if row[2] is not None]
+            }
+
+    def _iter_export_categories(self) -> Iterator[Tuple[str, Iterator[Dict]]]:
+        for (_, category_name), rows in groupby(self._export_category_rows(), key=itemgetter(0, 1)):
+            associations = ({
+                "topic": row[3],
+                "palace_name": row[4],
+                "content": self.codec.decode(row[5])
+            } for row in rows if row[2] is not None)
+            # Remove the session_id prefix from the category name
+            yield category_name.split('_', 1)[1], associations
+
+    @timed("db.get_change_token")
+    @with_connection
+    def get_change_token(self) -> int:
+        """High-water mark of the change log; export_delta(token) later returns what changed after it."""
+        return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+
+    @with_connection
+    def _session_change_token(self) -> int:
+        """The last change of this session, which moves only when the session writes."""
+        return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log WHERE session_id = ?",
+                                 (self.session_id,)).fetchone()[0]
+
+    @timed("db.export_data")
+    @with_connection
     def export_data(self) -> Dict:
         """Export all data for the current session."""
-        palaces = self.get_palaces()
-        categories = self.get_categories()
+        # Taken before the rows are read, so a write racing the export is repeated in the next delta, not lost
+        token = self.get_change_token()
+        return {
+            "token": token,
+            "palaces": list(self._iter_export_palaces()),
+            "categories": [{"name": name, "associations": list(associations)}
+                           for name, associations in self._iter_export_categories()],
+            "associations": []
+        }
+
+    def iter_export_json(self, token: Optional[int] = None) -> Iterator[str]:
+        """Export all data for the current session as JSON text, one chunk at a time.
+
+        Produces the same document as export_data without holding it in memory,
+        with token when the caller already took one. The connection is borrowed
+        until the last chunk is produced.
+        """
+        with self.connections.connection():
+            if token is None:
+                token = self.get_change_token()
+            yield '{\n  "token": ' + str(token) + ',\n  "palaces": ['
+            for i, palace in enumerate(self._iter_export_palaces()):
+                yield (",\n    " if i else "\n    ") + json.dumps(palace)
+            yield '\n  ],\n  "categories": ['
+            for i, (category_name, associations) in enumerate(self._iter_export_categories()):
+                yield (",\n    " if i else "\n    ") + '{"name": ' + json.dumps(category_name) + ', "associations": ['
+                for j, association in enumerate(associations):
+                    yield (",\n      " if j else "\n      ") + json.dumps(association)
+                yield "\n    ]}"
+            yield '\n  ],\n  "associations": []\n}\n'
+
+    @timed("db.export_delta")
+    @with_connection
+    def export_delta(self, since: int) -> Dict:
+        """Export the rows the session added after the change token since.
 
-        data = {
-            "palaces": [],
-            "categories": [],
+        The result has the export_data layout, so import_data applies it like a
+        full export and applying it twice changes nothing. Palaces referenced by
+        new items or associations are included by name so the delta imports on
+        its own, and "token" is the mark to pass as since for the next delta.
+        """
+        token = self.get_change_token()
+        changed: Dict[str, List[int]] = {}
+        for kind, row_id in self.conn.execute("""
+        SELECT kind, row_id FROM change_log WHERE session_id = ? AND seq > ? AND seq <= ? ORDER BY seq
+        """, (self.session_id, since, token)):
+            changed.setdefault(kind, []).append(row_id)
+        if not changed:
+            return {"format": "delta", "since": since, "token": token, "palaces": [], "categories": [],
+                    "associations": []}
+
+        def rows(sql: str, kind: str) -> List[tuple]:
+            return self.conn.execute(sql, (json.dumps(changed.get(kind, [])),)).fetchall()
+
+        palaces: Dict[str, List[str]] = {}
+        for (palace_name,) in rows("""
+        SELECT display_name FROM palaces WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id
+        """, "palace"):
+            palaces.setdefault(palace_name, [])
+        for palace_name, item_name in rows("""
+        SELECT p.display_name, i.item_name
+        FROM items i JOIN palaces p ON p.id = i.palace_id
+        WHERE i.id IN (SELECT value FROM json_each(?))
+        ORDER BY i.id
+        """, "item"):
+            palaces.setdefault(palace_name, []).append(item_name)
+
+        categories: Dict[str, List[Dict]] = {}
+        for (category_name,) in rows("""
+        SELECT name FROM categories WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id
+        """, "category"):
+            categories.setdefault(category_name.split('_', 1)[1], [])
+        for category_name, topic, palace_name, content in rows("""
+        SELECT c.name, a.topic, p.display_name, a.content
+        FROM associations a
+        JOIN categories c ON c.id = a.category_id
+        LEFT JOIN palaces p ON p.id = a.palace_id
+        WHERE a.id IN (SELECT value FROM json_each(?))
+        ORDER BY a.id
+        """, "association"):
+            categories.setdefault(category_name.split('_', 1)[1], []).append(
+                {"topic": topic, "palace_name": palace_name, "content": self.codec.decode(content)})
+            if palace_name is not None:
+                palaces.setdefault(palace_name, [])
+
+        return {
+            "format": "delta",
+            "since": since,
+            "token": token,
+            "palaces": [{"name": name, "items": items} for name, items in palaces.items()],
+            "categories": [{"name": name, "associations": associations} for name, associations in categories.items()],
             "associations": []
         }
 
-        for palace_id, palace_name in palaces:
-            items = self.get_palace_items(palace_id)
-            data["palaces"].append({
-                "name": palace_name,
-                "items": items
-            })
-
-        for category_id, category_name in categories:
-            associations = self.get_associations(category_id)
-            data["categories"].append({
-                "name": category_name,
-                "associations": [{
-                    "topic": assoc[1],
-                    "palace_name": next(
-                        p["name"] for p in data["palaces"] if p["name"] == self.get_palace_name(assoc[2])),
-                    "content": assoc[3]
-                } for assoc in associations]
-            })
-
-        return data
-
-    def import_data(self, data: Dict):
-        """Import data into the database."""
-        for palace in data["palaces"]:
-            palace_id = self.add_palace(palace["name"])
-            if palace_id:
-                self.add_items(palace_id, palace["items"])
-
-        for category in data["categories"]:
-            category_id = self.add_category(category["name"])
-            if category_id:
-                for assoc in category["associations"]:
-                    palace_id = self.get_palace_id(assoc["palace_name"])
-                    if palace_id:
-                        self.save_association(assoc["topic"], category_id, palace_id, assoc["content"])
+    @timed("db.get_export_json")
+    def get_export_json(self) -> Tuple[int, str]:
+        """The change token and iter_export_json document, kept in the read cache until the next write."""
+        return self.read_cache.get_or_load("export_json", self._load_export_json)
+
+    @with_connection
+    def _load_export_json(self) -> Tuple[int, str]:
+        token = self.get_change_token()
+        return token, "".join(self.iter_export_json(token))
+
+    @timed("db.get_delta_json")
+    def get_delta_json(self, since: int) -> Tuple[int, int, str]:
+        """The token, number of changed records and JSON of export_delta(since).
+
+        Cached per since and per last change of the session, so it is only
+        rebuilt after the session writes.
+        """
+        return self.read_cache.get_or_load(("delta", since, self._session_change_token()),
+                                           lambda: self._load_delta_json(since))
+
+    def _load_delta_json(self, since: int) -> Tuple[int, int, str]:
+        delta = self.export_delta(since)
+        changed = sum(len(palace["items"]) + 1 for palace in delta["palaces"]) + \
+            sum(len(category["associations"]) + 1 for category in delta["categories"])
+        return delta["token"], changed, json.dumps(delta, separators=(",", ":"))
+
+    @timed("db.import_data")
+    @with_connection
+    def import_data(self, data: Dict, progress_callback: Optional[Callable[[int, int], None]] = None):
+        """Import data into the database in a single transaction.
+
+        Palaces and categories that already exist are merged: only items and
+        associations they did not have before the import are added, so importing
+        the same file twice changes nothing, while repeats within the file are
+        kept as they are. progress_callback(done, total) is called as
+        palaces and associations are written.
+        """
+        palaces = data.get("palaces", [])
+        categories = data.get("categories", [])
+        total = len(palaces) + sum(len(category.get("associations", [])) for category in categories)
+        done = 0
+
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            palace_ids = self._upsert_palaces([palace["name"] for palace in palaces])
+            existing_items = {}
+            for palace_id, item_name in conn.execute("""
+            SELECT i.palace_id, i.item_name
+            FROM items i
+            JOIN palaces p ON p.id = i.palace_id
+            WHERE p.session_id = ?
+            """, (self.session_id,)):
+                existing_items.setdefault(palace_id, set()).add(item_name)
+
+            item_rows = []
+            for palace in palaces:
+                palace_id = palace_ids[palace["name"]]
+                known = existing_items.get(palace_id, set())
+                item_rows.extend((palace_id, item) for item in palace.get("items", []) if item not in known)
+            conn.executemany("INSERT INTO items (palace_id, item_name) VALUES (?, ?)", item_rows)
+            done += len(palaces)
+            if progress_callback:
+                progress_callback(done, total)
+
+            category_ids = self._upsert_categories([category["name"] for category in categories])
+            existing_associations = {(category_id, topic, palace_id, self.codec.decode(content))
+                                     for category_id, topic, palace_id, content in conn.execute("""
+            SELECT a.category_id, a.topic, a.palace_id, a.content
+            FROM associations a
+            JOIN categories c ON c.id = a.category_id
+            WHERE c.session_id = ?
+            """, (self.session_id,))}
+
+            for category in categories:
+                category_id = category_ids[category["name"]]
+                rows = []
+                for assoc in category.get("associations", []):
+                    palace_id = palace_ids.get(assoc["palace_name"])
+                    row = (category_id, assoc["topic"], palace_id, assoc["content"])
+                    if palace_id and row not in existing_associations:
+                        rows.append(row)
+                for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+                    batch = rows[start:start + IMPORT_BATCH_SIZE]
+                    # Assign ids up front so the entries can be inserted in bulk too
+                    next_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM associations").fetchone()[0]
+                    conn.executemany("""
+                    INSERT INTO associations (id, category_id, topic, palace_id, content)
+                    VALUES (?, ?, ?, ?, ?)
+                    """, [(next_id + i,) + row[:3] + (self.codec.encode(row[3]),) for i, row in enumerate(batch)])
+                    self._insert_entries([(next_id + i, parse_association_content(row[3]))
+                                          for i, row in enumerate(batch)])
+                    if progress_callback:
+                        progress_callback(done + start + len(batch), total)
+                done += len(category.get("associations", []))
+            if progress_callback:
+                progress_callback(done, total)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.read_cache.clear()
+
+    @with_connection
+    def _upsert_palaces(self, names: List[str]) -> Dict[str, int]:
+        """Create the palaces that do not exist yet and map every session palace name to its id."""
+        self.conn.executemany("INSERT OR IGNORE INTO palaces (session_id, name, display_name) VALUES (?, ?, ?)",
+                              [(self.session_id, f"{self.session_id}_{name}", name) for name in names])
+        rows = self.conn.execute("SELECT id, display_name FROM palaces WHERE session_id = ?", (self.session_id,))
+        return {name: palace_id for palace_id, name in rows}
+
+    @with_connection
+    def _upsert_categories(self, names: List[str]) -> Dict[str, int]:
+        """Create the categories that do not exist yet and map every session category name to its id."""
+        self.conn.executemany("INSERT OR IGNORE INTO categories (session_id, name) VALUES (?, ?)",
+                              [(self.session_id, f"{self.session_id}_{name}") for name in names])
+        rows = self.conn.execute("SELECT id, name FROM categories WHERE session_id = ?", (self.session_id,))
+        return {name.split('_', 1)[1]: category_id for category_id, name in rows}
 
+    @timed("db.get_palace_name")
     def get_palace_name(self, palace_id: int) -> str:
-        self.cursor.execute("SELECT display_name FROM palaces WHERE id = ?", (palace_id,))
-        result = self.cursor.fetchone()
-        return result[0] if result else None
+        return self.get_palace_map().get(palace_id)
 
+    @timed("db.get_palace_id")
     def get_palace_id(self, palace_name: str) -> int:
-        self.cursor.execute("SELECT id FROM palaces WHERE display_name = ? AND session_id = ?",
-                            (palace_name, self.session_id))
-        result = self.cursor.fetchone()
-        return result[0] if result else None
+        return next((palace_id for palace_id, name in self.get_palaces() if name == palace_name), None)
 
     def close(self):
-        self.conn.close()
\ No newline at end of file
+        """Wait for this process's queued writes to commit, then close the pool's idle connections."""
+        if self.writer is not None:
+            self.writer.flush()
+        self.connections.close()
@@ -0,0 +1,160 @@
+import functools
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, TypeVar
+
+# Seconds a connection waits on a locked database before raising "database is locked"
+BUSY_TIMEOUT = float(os.environ.get("MEMORY_PALACE_DB_BUSY_TIMEOUT", "10"))
+# Connections kept open per database file, shared by every thread of the process
+POOL_SIZE = int(os.environ.get("MEMORY_PALACE_DB_POOL_SIZE", "16"))
+
+PRAGMAS = (
+    # Only takes effect on a new file, so it must come before journal_mode writes the header.
+    # Existing files are converted once with `python -m retention --enable-incremental-vacuum`.
+    "PRAGMA auto_vacuum = INCREMENTAL",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}",
+)
+
+Method = TypeVar("Method", bound=Callable)
+
+
+def connect(db_name: str) -> sqlite3.Connection:
+    """Open a connection with the WAL journal and the tuned pragmas applied.
+
+    The connection may be used from any thread, one thread at a time.
+    """
+    conn = sqlite3.connect(db_name, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class _Lease:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.depth = 0
+
+
+class ConnectionPool:
+    """Up to max_size open SQLite connections for a database file, lent out per operation.
+
+    Streamlit starts a new thread for every script run, so connections are not
+    tied to threads: an operation borrows one with connection() and returns it
+    when done, keeping it open, with its pragmas and page cache, for the next
+    operation of any thread. Operations nested inside one on the same thread
+    share its connection. WAL lets the borrowed connections read while another
+    one writes.
+    """
+
+    def __init__(self, db_name: str, max_size: int = POOL_SIZE):
+        self.db_name = db_name
+        self.max_size = max_size
+        self.idle: List[sqlite3.Connection] = []
+        self.opened = 0
+        self.condition = threading.Condition()
+        self.local = threading.local()
+
+    def _acquire(self) -> sqlite3.Connection:
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.idle or self.opened < self.max_size, BUSY_TIMEOUT):
+                raise TimeoutError(f"No connection to {self.db_name} became free within {BUSY_TIMEOUT}s")
+            if self.idle:
+                # Most recently returned first, since its page cache is the warmest
+                return self.idle.pop()
+            self.opened += 1
+        try:
+            return connect(self.db_name)
+        except Exception:
+            with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            raise
+
+    def _release(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                # Every operation commits its own writes; never hand an open transaction to the next one
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            return
+        with self.condition:
+            self.idle.append(conn)
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection for the duration of the with block."""
+        lease = getattr(self.local, "lease", None)
+        if lease is None:
+            lease = self.local.lease = _Lease(self._acquire())
+        lease.depth += 1
+        try:
+            yield lease.conn
+        finally:
+            lease.depth -= 1
+            if lease.depth == 0:
+                self.local.lease = None
+                lease.cursor.close()
+                self._release(lease.conn)
+
+    @contextmanager
+    def lend(self, conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+        """Make conn, which the caller keeps, this thread's borrowed connection for the with block."""
+        if getattr(self.local, "lease", None) is not None:
+            raise RuntimeError("A connection is already borrowed on this thread")
+        lease = self.local.lease = _Lease(conn)
+        lease.depth = 1
+        try:
+            yield conn
+        finally:
+            self.local.lease = None
+            lease.cursor.close()
+
+    def current(self) -> _Lease:
+        lease = getattr(self.local, "lease", None)
+        if lease is None:
+            raise RuntimeError("No connection is borrowed on this thread; use connection() or with_connection")
+        return lease
+
+    def close(self):
+        """Close the idle connections; borrowed ones go back to the pool and are reopened as needed."""
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.opened -= len(idle)
+            self.condition.notify_all()
+        for conn in idle:
+            conn.close()
+
+
+def with_connection(method: Method) -> Method:
+    """Run a method of an object with a `connections` pool while it holds one of the pool's connections."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.connections.connection():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_manager(db_name: str) -> ConnectionPool:
+    """Return the process-wide connection pool for db_name."""
+    key = os.path.abspath(db_name) if db_name != ":memory:" else db_name
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(db_name)
+        return _pools[key]
@@ -0,0 +1,319 @@
+import sqlite3
+import time
+from typing import Callable, List, Tuple
+
+from association_format import parse_association_content
+from content_compression import (COMPRESS_CONTENT, MIN_TRAINING_SAMPLES, recompress_contents, sample_contents,
+                                 store_dictionary, train_dictionary)
+
+
+def _add_lookup_indexes(conn: sqlite3.Connection):
+    # Covers get_palace_items and keeps items in insertion order
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_items_palace_id ON items (palace_id, id, item_name)")
+    # Covers get_palaces and get_palace_id
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_palaces_session_display_name ON palaces (session_id, display_name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_associations_category_id ON associations (category_id)")
+
+
+def _add_association_entries(conn: sqlite3.Connection):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS association_entries (
+        id INTEGER PRIMARY KEY,
+        association_id INTEGER,
+        position INTEGER,
+        item TEXT,
+        point TEXT,
+        imagery TEXT,
+        FOREIGN KEY (association_id) REFERENCES associations (id)
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_association_entries_association_id "
+                 "ON association_entries (association_id, position)")
+    # Backfill from the free-text content saved before entries were stored
+    rows = conn.execute("SELECT id, content FROM associations ORDER BY id").fetchall()
+    conn.executemany(
+        "INSERT INTO association_entries (association_id, position, item, point, imagery) VALUES (?, ?, ?, ?, ?)",
+        [(association_id, position, item, point, imagery)
+         for association_id, content in rows
+         for position, (item, point, imagery) in enumerate(parse_association_content(content))]
+    )
+
+
+def _add_search_index(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS association_search
+    USING fts5(topic, item, point, imagery, tokenize = 'porter unicode61')
+    """)
+    # Keep the index in sync with every write; rowid is the association_entries id
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS association_entries_search_insert AFTER INSERT ON association_entries BEGIN
+        INSERT INTO association_search (rowid, topic, item, point, imagery)
+        VALUES (new.id, (SELECT topic FROM associations WHERE id = new.association_id),
+                new.item, new.point, new.imagery);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS association_entries_search_delete AFTER DELETE ON association_entries BEGIN
+        DELETE FROM association_search WHERE rowid = old.id;
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS association_entries_search_update AFTER UPDATE ON association_entries BEGIN
+        DELETE FROM association_search WHERE rowid = old.id;
+        INSERT INTO association_search (rowid, topic, item, point, imagery)
+        VALUES (new.id, (SELECT topic FROM associations WHERE id = new.association_id),
+                new.item, new.point, new.imagery);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS associations_search_topic_update AFTER UPDATE OF topic ON associations BEGIN
+        UPDATE association_search SET topic = new.topic
+        WHERE rowid IN (SELECT id FROM association_entries WHERE association_id = new.id);
+    END
+    """)
+    conn.execute("""
+    INSERT INTO association_search (rowid, topic, item, point, imagery)
+    SELECT e.id, a.topic, e.item, e.point, e.imagery
+    FROM association_entries e
+    JOIN associations a ON a.id = e.association_id
+    """)
+
+
+def _add_sessions(conn: sqlite3.Connection):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        last_active REAL
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_active ON sessions (last_active)")
+    # Sessions stored before activity was tracked start their retention period now
+    conn.execute("""
+    INSERT OR IGNORE INTO sessions (session_id, last_active)
+    SELECT session_id, ? FROM palaces
+    UNION
+    SELECT session_id, ? FROM categories
+    """, (time.time(), time.time()))
+
+
+def _add_generation_jobs(conn: sqlite3.Connection):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS generation_jobs (
+        id INTEGER PRIMARY KEY,
+        session_id TEXT,
+        topic TEXT,
+        palace_name TEXT,
+        category_name TEXT,
+        items TEXT,
+        points TEXT,
+        status TEXT,
+        error TEXT,
+        association_id INTEGER,
+        created_at REAL,
+        updated_at REAL
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_generation_jobs_session_id ON generation_jobs (session_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_generation_jobs_status ON generation_jobs (status)")
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS generation_job_results (
+        job_id INTEGER,
+        position INTEGER,
+        imagery TEXT,
+        error TEXT,
+        PRIMARY KEY (job_id, position),
+        FOREIGN KEY (job_id) REFERENCES generation_jobs (id)
+    )
+    ''')
+
+
+def _add_generation_batches(conn: sqlite3.Connection):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS generation_batches (
+        id INTEGER PRIMARY KEY,
+        session_id TEXT,
+        name TEXT,
+        created_at REAL
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_generation_batches_session_id ON generation_batches (session_id, id)")
+    conn.execute("ALTER TABLE generation_jobs ADD COLUMN batch_id INTEGER REFERENCES generation_batches (id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_generation_jobs_batch_id ON generation_jobs (batch_id, status)")
+
+
+# Session owning each kind of row, as a subquery on NEW inside the change_log triggers
+CHANGE_SESSIONS = {
+    "palaces": ("palace", "NEW.session_id"),
+    "items": ("item", "(SELECT session_id FROM palaces WHERE id = NEW.palace_id)"),
+    "categories": ("category", "NEW.session_id"),
+    "associations": ("association", "(SELECT session_id FROM categories WHERE id = NEW.category_id)"),
+}
+
+
+def _add_change_log(conn: sqlite3.Connection):
+    # AUTOINCREMENT keeps seq growing after retention deletes the newest rows, so tokens are never reused
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT,
+        kind TEXT,
+        row_id INTEGER
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_change_log_session_id ON change_log (session_id, seq)")
+    for table, (kind, session) in CHANGE_SESSIONS.items():
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_change_log AFTER INSERT ON {table} BEGIN
+            INSERT INTO change_log (session_id, kind, row_id) VALUES ({session}, '{kind}', NEW.id);
+        END
+        """)
+    # Existing rows count as changed since token 0, so the first delta is a full export
+    conn.execute("""
+    INSERT INTO change_log (session_id, kind, row_id)
+    SELECT session_id, 'palace', id FROM palaces
+    UNION ALL SELECT p.session_id, 'item', i.id FROM items i JOIN palaces p ON p.id = i.palace_id
+    UNION ALL SELECT session_id, 'category', id FROM categories
+    UNION ALL SELECT c.session_id, 'association', a.id FROM associations a JOIN categories c ON c.id = a.category_id
+    """)
+
+
+def _add_keyset_indexes(conn: sqlite3.Connection):
+    # Lets get_palace_summaries walk a session's palaces in id order without sorting them all.
+    # Associations already page through idx_associations_category_id, which ends in the rowid.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_palaces_session_id ON palaces (session_id, id)")
+
+
+def _compress_association_content(conn: sqlite3.Connection):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS content_dictionaries (
+        id INTEGER PRIMARY KEY,
+        dictionary BLOB,
+        samples INTEGER,
+        trained_at REAL
+    )
+    ''')
+    if not COMPRESS_CONTENT:
+        return
+    # Content is still plain text here; train on it when there is enough, then compress every row
+    samples = sample_contents(conn, lambda content: content)
+    dictionary_id, dictionary = 0, b""
+    if len(samples) >= MIN_TRAINING_SAMPLES:
+        dictionary = train_dictionary(samples)
+        dictionary_id = store_dictionary(conn, dictionary, len(samples))
+    recompress_contents(conn, lambda content: content, dictionary_id, dictionary)
+
+
+def session_search_token(session_id: str) -> str:
+    """The single FTS token association_search stores for a session; hex keeps the tokenizer from splitting it."""
+    return "s" + session_id.encode("utf-8").hex()
+
+
+# The session_search_token of the session owning association_entries row NEW, in SQL
+_ENTRY_SEARCH_SESSION = """(SELECT 's' || lower(hex(c.session_id))
+                FROM associations a JOIN categories c ON c.id = a.category_id
+                WHERE a.id = new.association_id)"""
+
+
+def _rebuild_search_index(conn: sqlite3.Connection, options: str = ""):
+    """Recreate association_search, its triggers and its rows; options are extra FTS5 table options."""
+    for trigger in ("association_entries_search_insert", "association_entries_search_delete",
+                    "association_entries_search_update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS association_search")
+    conn.execute(f"""
+    CREATE VIRTUAL TABLE association_search
+    USING fts5(topic, item, point, imagery, session, tokenize = 'porter unicode61'{options})
+    """)
+    # The session column must not move results up or down
+    conn.execute("INSERT INTO association_search (association_search, rank) VALUES ('rank', 'bm25(1, 1, 1, 1, 0)')")
+    conn.execute(f"""
+    CREATE TRIGGER association_entries_search_insert AFTER INSERT ON association_entries BEGIN
+        INSERT INTO association_search (rowid, topic, item, point, imagery, session)
+        VALUES (new.id, (SELECT topic FROM associations WHERE id = new.association_id),
+                new.item, new.point, new.imagery, {_ENTRY_SEARCH_SESSION});
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER association_entries_search_delete AFTER DELETE ON association_entries BEGIN
+        DELETE FROM association_search WHERE rowid = old.id;
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER association_entries_search_update AFTER UPDATE ON association_entries BEGIN
+        DELETE FROM association_search WHERE rowid = old.id;
+        INSERT INTO association_search (rowid, topic, item, point, imagery, session)
+        VALUES (new.id, (SELECT topic FROM associations WHERE id = new.association_id),
+                new.item, new.point, new.imagery, {_ENTRY_SEARCH_SESSION});
+    END
+    """)
+    conn.execute("""
+    INSERT INTO association_search (rowid, topic, item, point, imagery, session)
+    SELECT e.id, a.topic, e.item, e.point, e.imagery, 's' || lower(hex(c.session_id))
+    FROM association_entries e
+    JOIN associations a ON a.id = e.association_id
+    JOIN categories c ON c.id = a.category_id
+    """)
+
+
+def _scope_search_index_by_session(conn: sqlite3.Connection):
+    # FTS5 cannot add a column, so the index is rebuilt with one holding the owning session's token.
+    # MATCHing it makes a search intersect only that session's doclists before ranking.
+    _rebuild_search_index(conn)
+
+
+def _add_search_prefix_index(conn: sqlite3.Connection):
+    # search matches its last term as a prefix; without prefix indexes FTS5 merges the doclist of
+    # every indexed term starting with it. Two and three letters are what a search while typing sends.
+    _rebuild_search_index(conn, ", prefix = '2 3'")
+
+
+# Ordered schema changes; append new migrations with the next version number and never edit applied ones
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "indexes for palace, item and association lookups", _add_lookup_indexes),
+    (2, "structured association entries", _add_association_entries),
+    (3, "full-text search over association entries", _add_search_index),
+    (4, "session activity tracking", _add_sessions),
+    (5, "background generation jobs", _add_generation_jobs),
+    (6, "bulk generation batches", _add_generation_batches),
+    (7, "change log for delta exports", _add_change_log),
+    (8, "keyset pagination indexes", _add_keyset_indexes),
+    (9, "compressed association content", _compress_association_content),
+    (10, "session-scoped full-text search", _scope_search_index_by_session),
+    (11, "prefix indexes for full-text search", _add_search_prefix_index),
+]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """Bring the database up to the latest schema version and return that version.
+
+    Each migration runs in its own write transaction, and the version is
+    re-checked inside it so concurrent processes never apply one twice.
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at REAL
+    )
+    ''')
+    conn.commit()
+
+    for version, description, migrate in MIGRATIONS:
+        if get_schema_version(conn) >= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if get_schema_version(conn) < version:
+                migrate(conn)
+                conn.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                             (version, description, time.time()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return get_schema_version(conn)
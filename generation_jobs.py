@@ -0,0 +1,361 @@
+import csv
+import io
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+from association_format import format_association_content
+from database_operations import DatabaseOperations
+from db_connection import get_connection_manager
+from llm_operations import (build_imagery_prompt, parse_bullet_points, predict_topic_with_metrics,
+                            predict_with_metrics, run_concurrently)
+
+logger = logging.getLogger(__name__)
+
+# Palaces generated at the same time; each job still runs its item calls concurrently
+JOB_WORKERS = int(os.environ.get("MEMORY_PALACE_JOB_WORKERS", "2"))
+
+# Generated bulk topics saved per transaction; a batch's last topics are saved however few remain
+BATCH_SAVE_SIZE = int(os.environ.get("MEMORY_PALACE_BATCH_SAVE_SIZE", "10"))
+
+UNFINISHED_STATUSES = ("pending", "running")
+
+
+def parse_topic_rows(file_name: str, data: bytes) -> List[Dict]:
+    """Read (topic, category, palace) rows, with optional palace items, from a CSV or JSON upload.
+
+    CSV files need a header naming the topic, category and palace columns; an
+    items column holds the palace items separated by semicolons. JSON files
+    hold a list of objects with the same keys, items as a list or a string.
+    """
+    text = data.decode("utf-8-sig")
+    if file_name.lower().endswith(".json"):
+        records = json.loads(text)
+        if not isinstance(records, list):
+            raise ValueError("The JSON file must contain a list of topic rows")
+    else:
+        records = list(csv.DictReader(io.StringIO(text)))
+
+    rows = []
+    for number, record in enumerate(records, start=1):
+        if not isinstance(record, dict):
+            raise ValueError(f"Row {number} is not an object with topic, category and palace")
+        record = {str(key).strip().lower(): value for key, value in record.items() if key is not None}
+        topic, category, palace = (str(record.get(key) or "").strip() for key in ("topic", "category", "palace"))
+        if not (topic and category and palace):
+            raise ValueError(f"Row {number} needs a topic, a category and a palace")
+        items = record.get("items") or []
+        if isinstance(items, str):
+            items = items.split(";")
+        rows.append({"topic": topic, "category": category, "palace": palace,
+                     "items": [str(item).strip() for item in items if str(item).strip()]})
+    return rows
+
+
+class GenerationJobQueue:
+    """Runs palace generation on a worker pool, independent of Streamlit script runs.
+
+    Job state, the topic points and every finished item are stored in SQLite as
+    soon as they exist, so a rerun never loses work and a restarted process
+    resumes unfinished jobs without repeating the item calls that completed.
+    """
+
+    def __init__(self, db_name: str = "memory_palace.db", max_workers: int = JOB_WORKERS):
+        self.db_name = db_name
+        self.connections = get_connection_manager(db_name)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="generation-job")
+        self.active = set()
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.resumed = False
+
+    def submit(self, session_id: str, topic: str, palace_name: str, category_name: str,
+               items: Sequence[str], llm) -> int:
+        """Queue a palace generation and return its job id."""
+        # Make sure the schema, jobs tables included, exists before the first insert
+        DatabaseOperations(self.db_name, session_id=session_id)
+        now = time.time()
+        with self.connections.connection() as conn:
+            job_id = conn.execute("""
+            INSERT INTO generation_jobs (session_id, topic, palace_name, category_name, items, status,
+                                         created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, 'pending', ?, ?)
+            """, (session_id, topic, palace_name, category_name, json.dumps(list(items)), now, now)).lastrowid
+            conn.commit()
+        self._start(job_id, llm)
+        return job_id
+
+    def submit_batch(self, session_id: str, name: str, rows: Sequence[Dict], llm) -> int:
+        """Queue one job per (topic, category, palace) row as a batch and return the batch id.
+
+        Palaces missing from the session are created from the row's items, and
+        missing categories are created up front. Rows naming an unknown palace
+        without items raise ValueError before anything is queued.
+        """
+        db = DatabaseOperations(self.db_name, session_id=session_id)
+        palace_items = {}
+        for row in rows:
+            if row["palace"] in palace_items:
+                continue
+            palace_id = db.get_palace_id(row["palace"])
+            if palace_id is not None:
+                palace_items[row["palace"]] = db.get_palace_items(palace_id)
+            elif row["items"]:
+                palace_items[row["palace"]] = row["items"]
+            else:
+                raise ValueError(f"Palace '{row['palace']}' does not exist; add its items to the row")
+        for palace_name, items in palace_items.items():
+            if db.get_palace_id(palace_name) is None:
+                db.add_items(db.add_palace(palace_name), items)
+        known_categories = {name for _, name in db.get_categories()}
+        for category_name in dict.fromkeys(row["category"] for row in rows):
+            if category_name not in known_categories:
+                db.add_category(category_name)
+
+        now = time.time()
+        with self.connections.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                batch_id = conn.execute(
+                    "INSERT INTO generation_batches (session_id, name, created_at) VALUES (?, ?, ?)",
+                    (session_id, name, now)).lastrowid
+                conn.executemany("""
+                INSERT INTO generation_jobs (session_id, batch_id, topic, palace_name, category_name, items, status,
+                                             created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, 'pending', ?, ?)
+                """, [(session_id, batch_id, row["topic"], row["palace"], row["category"],
+                       json.dumps(palace_items[row["palace"]]), now, now) for row in rows])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            job_ids = [job_id for (job_id,) in conn.execute(
+                "SELECT id FROM generation_jobs WHERE batch_id = ? ORDER BY id", (batch_id,))]
+        for job_id in job_ids:
+            self._start(job_id, llm)
+        return batch_id
+
+    def resume_incomplete(self, llm):
+        """Restart jobs left unfinished by a previous process; only the first call per process does anything."""
+        with self.lock:
+            if self.resumed:
+                return
+            self.resumed = True
+        with self.connections.connection() as conn:
+            rows = conn.execute(
+                "SELECT id FROM generation_jobs WHERE status IN (?, ?) ORDER BY id", UNFINISHED_STATUSES).fetchall()
+            # Batches whose topics were all generated but not yet saved when the process stopped
+            generated = conn.execute(
+                "SELECT DISTINCT batch_id FROM generation_jobs WHERE status = 'generated'").fetchall()
+        for (job_id,) in rows:
+            self._start(job_id, llm)
+        for (batch_id,) in generated:
+            self.executor.submit(self._save_batch, batch_id)
+
+    def _start(self, job_id: int, llm):
+        with self.lock:
+            if job_id in self.active:
+                return
+            self.active.add(job_id)
+        self.executor.submit(self._run, job_id, llm)
+
+    def _update(self, job_id: int, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.connections.connection() as conn:
+            conn.execute(f"UPDATE generation_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            conn.commit()
+
+    def _store_result(self, job_id: int, position: int, imagery: Optional[str], error: Optional[str]):
+        with self.connections.connection() as conn:
+            conn.execute("""
+            INSERT OR REPLACE INTO generation_job_results (job_id, position, imagery, error)
+            VALUES (?, ?, ?, ?)
+            """, (job_id, position, imagery, error))
+            conn.commit()
+
+    def _run(self, job_id: int, llm):
+        try:
+            batch_id = self._generate(job_id, llm)
+        except Exception as e:
+            logger.exception("Generation job %s failed", job_id)
+            self._update(job_id, status="failed", error=str(e))
+            with self.connections.connection() as conn:
+                batch_id = conn.execute("SELECT batch_id FROM generation_jobs WHERE id = ?", (job_id,)).fetchone()[0]
+        finally:
+            with self.lock:
+                self.active.discard(job_id)
+        if batch_id is not None:
+            try:
+                self._save_batch(batch_id)
+            except Exception:
+                # The topics stay generated and are saved with the batch's next topics or on resume
+                logger.exception("Saving generation batch %s failed", batch_id)
+
+    def _generate(self, job_id: int, llm) -> Optional[int]:
+        """Generate a job's points and imagery; single jobs are saved here, bulk jobs return their batch id."""
+        with self.connections.connection() as conn:
+            session_id, batch_id, topic, palace_name, category_name, items, points = conn.execute("""
+            SELECT session_id, batch_id, topic, palace_name, category_name, items, points
+            FROM generation_jobs WHERE id = ?
+            """, (job_id,)).fetchone()
+        items = json.loads(items)
+        self._update(job_id, status="running")
+
+        if points is None:
+            points = parse_bullet_points(predict_topic_with_metrics(llm, topic))
+            self._update(job_id, points=json.dumps(points))
+        else:
+            points = json.loads(points)
+
+        with self.connections.connection() as conn:
+            finished = {position for (position,) in conn.execute(
+                "SELECT position FROM generation_job_results WHERE job_id = ? AND error IS NULL", (job_id,))}
+        pending = [(position, item, point) for position, (item, point) in enumerate(zip(items, points))
+                   if position not in finished]
+
+        def generate_item(position, item, point):
+            try:
+                imagery = predict_with_metrics(llm, build_imagery_prompt(item, point), "get_memorable_imagery")
+            except Exception as e:
+                self._store_result(job_id, position, None, str(e))
+                raise
+            self._store_result(job_id, position, imagery, None)
+
+        run_concurrently(generate_item, pending)
+
+        if batch_id is not None:
+            self._update(job_id, status="generated")
+            return batch_id
+
+        entries = self._entries(job_id, items, points)
+        db = DatabaseOperations(self.db_name, session_id=session_id)
+        palace_id = db.get_palace_id(palace_name)
+        if palace_id is None:
+            palace_id = db.add_palace(palace_name)
+            db.add_items(palace_id, items)
+        category_id = {name: cat_id for cat_id, name in db.get_categories()}.get(category_name)
+        if category_id is None:
+            category_id = db.add_category(category_name)
+        # Marked done in the save's transaction, so a resumed job never saves the association twice
+        db.save_association(topic, category_id, palace_id, format_association_content(entries), entries,
+                            on_saved=lambda conn, association_id: conn.execute("""
+                            UPDATE generation_jobs SET status = 'done', association_id = ?, updated_at = ?
+                            WHERE id = ?
+                            """, (association_id, time.time(), job_id)))
+        return None
+
+    def _entries(self, job_id: int, items: List[str], points: List[str]) -> List[tuple]:
+        with self.connections.connection() as conn:
+            imagery = dict(conn.execute(
+                "SELECT position, imagery FROM generation_job_results WHERE job_id = ?", (job_id,)).fetchall())
+        return [(item, point, imagery.get(position) or "")
+                for position, (item, point) in enumerate(zip(items, points))]
+
+    def _save_batch(self, batch_id: int):
+        """Save the generated topics of a batch in one transaction once enough are waiting.
+
+        Fewer than BATCH_SAVE_SIZE are saved only when nothing else in the batch
+        is still generating.
+        """
+        with self.save_lock:
+            with self.connections.connection() as conn:
+                generating = conn.execute(
+                    "SELECT COUNT(*) FROM generation_jobs WHERE batch_id = ? AND status IN (?, ?)",
+                    (batch_id, *UNFINISHED_STATUSES)).fetchone()[0]
+                jobs = conn.execute("""
+                SELECT id, session_id, topic, palace_name, category_name, items, points
+                FROM generation_jobs WHERE batch_id = ? AND status = 'generated' ORDER BY id
+                """, (batch_id,)).fetchall()
+            if not jobs or (generating and len(jobs) < BATCH_SAVE_SIZE):
+                return
+
+            db = DatabaseOperations(self.db_name, session_id=jobs[0][1])
+            category_ids = {name: category_id for category_id, name in db.get_categories()}
+            associations = []
+            for job_id, _, topic, palace_name, category_name, items, points in jobs:
+                if category_name not in category_ids:
+                    category_ids[category_name] = db.add_category(category_name)
+                entries = self._entries(job_id, json.loads(items), json.loads(points))
+                associations.append((topic, category_ids[category_name], db.get_palace_id(palace_name),
+                                     format_association_content(entries), entries))
+
+            def mark_done(conn, association_ids):
+                # In the save's transaction, so a resumed batch never saves these topics twice
+                now = time.time()
+                conn.executemany("""
+                UPDATE generation_jobs SET status = 'done', association_id = ?, updated_at = ? WHERE id = ?
+                """, [(association_id, now, job[0]) for association_id, job in zip(association_ids, jobs)])
+
+            db.save_associations(associations, on_saved=mark_done)
+
+    def get_jobs(self, session_id: str, limit: int = 10) -> List[Dict]:
+        """Most recent jobs of a session with their progress, newest first."""
+        with self.connections.connection() as conn:
+            rows = conn.execute("""
+            SELECT j.id, j.topic, j.palace_name, j.category_name, j.items, j.points, j.status, j.error,
+                   j.association_id,
+                   (SELECT COUNT(*) FROM generation_job_results r WHERE r.job_id = j.id AND r.error IS NULL),
+                   (SELECT COUNT(*) FROM generation_job_results r WHERE r.job_id = j.id AND r.error IS NOT NULL)
+            FROM generation_jobs j
+            WHERE j.session_id = ? AND j.batch_id IS NULL
+            ORDER BY j.id DESC
+            LIMIT ?
+            """, (session_id, limit)).fetchall()
+        jobs = []
+        for (job_id, topic, palace_name, category_name, items, points, status, error, association_id,
+             done, failed) in rows:
+            # Until the topic points arrive the palace size is the best estimate of the work left
+            total = len(json.loads(items)) if points is None else min(len(json.loads(items)), len(json.loads(points)))
+            jobs.append({
+                "id": job_id, "topic": topic, "palace_name": palace_name, "category_name": category_name,
+                "total": total, "done": done, "failed": failed, "status": status,
+                "error": error, "association_id": association_id
+            })
+        return jobs
+
+    def get_batches(self, session_id: str, limit: int = 5) -> List[Dict]:
+        """Most recent bulk batches of a session with progress and throughput, newest first."""
+        with self.connections.connection() as conn:
+            rows = conn.execute("""
+            SELECT b.id, b.name, b.created_at,
+                   COUNT(j.id),
+                   SUM(j.status = 'done'),
+                   SUM(j.status = 'failed'),
+                   MAX(j.updated_at),
+                   (SELECT COUNT(*) FROM generation_job_results r JOIN generation_jobs rj ON rj.id = r.job_id
+                    WHERE rj.batch_id = b.id AND r.error IS NULL)
+            FROM generation_batches b
+            JOIN generation_jobs j ON j.batch_id = b.id
+            WHERE b.session_id = ?
+            GROUP BY b.id
+            ORDER BY b.id DESC
+            LIMIT ?
+            """, (session_id, limit)).fetchall()
+        batches = []
+        for batch_id, name, created_at, total, done, failed, updated_at, items_done in rows:
+            finished = done + failed == total
+            elapsed = max((updated_at if finished else time.time()) - created_at, 1e-6)
+            batches.append({
+                "id": batch_id, "name": name, "total": total, "done": done, "failed": failed,
+                "finished": finished, "elapsed_s": elapsed, "items_done": items_done,
+                "topics_per_min": done * 60 / elapsed, "items_per_s": items_done / elapsed
+            })
+        return batches
+
+
+_queues: Dict[str, GenerationJobQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_job_queue(db_name: str = "memory_palace.db") -> GenerationJobQueue:
+    """Return the process-wide job queue for db_name."""
+    key = os.path.abspath(db_name)
+    with _queues_lock:
+        if key not in _queues:
+            _queues[key] = GenerationJobQueue(db_name)
+        return _queues[key]
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+# Defaults can be overridden per deployment through the environment
+CACHE_PATH = os.environ.get("MEMORY_PALACE_LLM_CACHE", "llm_cache.db")
+CACHE_MAX_ENTRIES = int(os.environ.get("MEMORY_PALACE_LLM_CACHE_MAX_ENTRIES", "5000"))
+CACHE_TTL_SECONDS = float(os.environ.get("MEMORY_PALACE_LLM_CACHE_TTL", str(7 * 24 * 3600)))
+
+
+def make_key(model: str, temperature, prompt: str) -> str:
+    """Hash the parameters that determine an LLM response."""
+    payload = json.dumps([model, temperature, prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Persistent LLM response cache with LRU and TTL eviction."""
+
+    def __init__(self, db_name: str = CACHE_PATH, max_entries: int = CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_name, check_same_thread=False)
+        self.create_tables()
+
+    def create_tables(self):
+        with self.lock:
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT,
+                created_at REAL,
+                last_access REAL
+            )
+            ''')
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)")
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache_stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER
+            )
+            ''')
+            self.conn.commit()
+
+    def _count(self, name: str):
+        self.conn.execute("""
+        INSERT INTO llm_cache_stats (name, value) VALUES (?, 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1
+        """, (name,))
+
+    def get(self, key: str, count: bool = True) -> Optional[str]:
+        """The fresh response stored under key, if any; count=False leaves the hit and miss counters alone."""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] <= self.ttl_seconds:
+                self.conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                if count:
+                    self._count("hits")
+                self.conn.commit()
+                return row[0]
+            if row:
+                self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            if count:
+                self._count("misses")
+            self.conn.commit()
+            return None
+
+    def set(self, key: str, response: str):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("""
+            INSERT OR REPLACE INTO llm_cache (key, response, created_at, last_access)
+            VALUES (?, ?, ?, ?)
+            """, (key, response, now, now))
+            self._evict(now)
+            self.conn.commit()
+
+    def _evict(self, now: float):
+        self.conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        self.conn.execute("""
+        DELETE FROM llm_cache WHERE key IN (
+            SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+        )
+        """, (self.max_entries,))
+
+    def delete(self, key: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self.conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            counters = dict(self.conn.execute("SELECT name, value FROM llm_cache_stats").fetchall())
+            entries = self.conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {"hits": counters.get("hits", 0), "misses": counters.get("misses", 0), "entries": entries}
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM llm_cache")
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+_shared_caches: Dict[str, LLMCache] = {}
+_shared_lock = threading.Lock()
+
+
+def get_llm_cache(db_name: str = CACHE_PATH) -> LLMCache:
+    """Return the process-wide cache for db_name, shared by every Streamlit session."""
+    with _shared_lock:
+        if db_name not in _shared_caches:
+            _shared_caches[db_name] = LLMCache(db_name)
+        return _shared_caches[db_name]
@@ -0,0 +1,403 @@
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import metrics
+from llm_cache import LLMCache, make_key
+from rate_limit import CALL_DEADLINE, COMPLETION_TOKENS_ESTIMATE, RateLimiter, llm_limiter
+from semantic_cache import SemanticTopicCache
+from single_flight import WAIT_TIMEOUT, SingleFlight, llm_flights
+
+# Upper bound on simultaneous LLM requests issued for a single palace
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MEMORY_PALACE_LLM_CONCURRENCY", "4"))
+
+TOPIC_PROMPT = "Provide important bullet points about {topic}:"
+OPENAI_MODEL = "gpt-3.5-turbo-instruct"
+
+
+class LazyLLM:
+    """Stands in for an LLM that is only built, imports included, on its first call.
+
+    model_name and temperature are known up front so response cache lookups
+    never need the real client.
+    """
+
+    def __init__(self, factory: Callable[[], Any], model_name: str, temperature: float):
+        self.factory = factory
+        self.model_name = model_name
+        self.temperature = temperature
+        self._llm = None
+        self.lock = threading.Lock()
+
+    @property
+    def llm(self):
+        with self.lock:
+            if self._llm is None:
+                self._llm = self.factory()
+            return self._llm
+
+    def predict(self, prompt: str) -> str:
+        return self.llm.predict(prompt)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        return self.llm.stream(prompt)
+
+
+def openai_llm(api_key: str, temperature: float = 0.6, model_name: str = OPENAI_MODEL,
+               base_url: Optional[str] = None) -> LazyLLM:
+    """OpenAI completion model; langchain is imported when the first prompt is sent.
+
+    The client does not retry by itself, since LLMClient's rate limiter owns retries,
+    and no single request may run past the call deadline those retries share.
+    """
+    def build():
+        from langchain_community.llms import OpenAI
+        return OpenAI(model_name=model_name, temperature=temperature, openai_api_key=api_key,
+                      openai_api_base=base_url, max_retries=0,
+                      request_timeout=CALL_DEADLINE)
+
+    return LazyLLM(build, model_name, temperature)
+
+
+class LLMClient:
+    """Front door for LLM calls made by the pages.
+
+    predict() answers from the persistent response cache when possible. With
+    bypass_cache the cache is not consulted, but the fresh response still
+    replaces the stored one. A caller that passes accept only gets, and only
+    stores, responses accept() approves, so an unusable reply is never cached.
+    Identical prompts in flight at the same time, from any session, share a
+    single LLM call. predict_topic() and stream_topic() also reuse the response
+    to a near-identical topic from the semantic cache. Calls that reach the LLM
+    go through the process-wide rate limiter, which retries throttled and
+    transient failures.
+    """
+
+    def __init__(self, llm, cache: Optional[LLMCache] = None, bypass_cache: bool = False,
+                 flights: SingleFlight = llm_flights, wait_timeout: float = WAIT_TIMEOUT,
+                 semantic_cache: Optional[SemanticTopicCache] = None, limiter: Optional[RateLimiter] = llm_limiter):
+        self.llm = llm
+        self.cache = cache
+        self.bypass_cache = bypass_cache
+        self.semantic_cache = semantic_cache
+        self.limiter = limiter
+        self.flights = flights
+        self.wait_timeout = wait_timeout
+
+    def cache_key(self, prompt: str) -> str:
+        model = getattr(self.llm, "model_name", type(self.llm).__name__)
+        return make_key(model, getattr(self.llm, "temperature", None), prompt)
+
+    def cached(self, key: str, accept: Optional[Callable[[str], bool]] = None, count: bool = True) -> Optional[str]:
+        if self.cache is None or self.bypass_cache:
+            return None
+        response = self.cache.get(key, count)
+        if response is not None and accept is not None and not accept(response):
+            # Stored before it was validated; drop it so the next call asks the LLM again
+            self.cache.delete(key)
+            return None
+        return response
+
+    def fetch(self, key: str, prompt: str, accept: Optional[Callable[[str], bool]] = None) -> str:
+        # A flight that finished between the caller's cache lookup and this one has already stored the response.
+        # The caller's lookup already counted the miss, so this one is not counted again.
+        cached = self.cached(key, accept, count=False)
+        if cached is not None:
+            return cached
+        if self.limiter is None:
+            response = self.llm.predict(prompt)
+        else:
+            reserved = metrics.estimate_tokens(prompt) + COMPLETION_TOKENS_ESTIMATE
+            response = self.limiter.call(lambda: self.llm.predict(prompt), reserved)
+            self.limiter.refund_tokens(reserved, metrics.estimate_tokens(prompt) + metrics.estimate_tokens(response))
+        if self.cache is not None and (accept is None or accept(response)):
+            self.cache.set(key, response)
+        return response
+
+    def open_stream(self, prompt: str) -> Iterator[str]:
+        if self.limiter is None:
+            return self.llm.stream(prompt)
+        reserved = metrics.estimate_tokens(prompt) + COMPLETION_TOKENS_ESTIMATE
+        return self.limiter.stream(lambda: self.llm.stream(prompt), reserved)
+
+    def predict(self, prompt: str, accept: Optional[Callable[[str], bool]] = None) -> str:
+        key = self.cache_key(prompt)
+        cached = self.cached(key, accept)
+        if cached is not None:
+            return cached
+        return self.flights.do(key, lambda: self.fetch(key, prompt, accept), self.wait_timeout)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Yield the response in chunks as they arrive.
+
+        A cache hit, or a response shared with an identical call already in
+        flight, is yielded whole.
+        """
+        key = self.cache_key(prompt)
+        cached = self.cached(key)
+        if cached is not None:
+            yield cached
+            return
+        flight, leader = self.flights.begin(key)
+        if not leader:
+            yield self.flights.wait(flight, self.wait_timeout)
+            return
+        cached = self.cached(key, count=False)
+        if cached is not None:
+            self.flights.finish(key, flight, cached)
+            yield cached
+            return
+        chunks = []
+        try:
+            for chunk in self.open_stream(prompt):
+                chunks.append(chunk)
+                yield chunk
+        except GeneratorExit:
+            self.flights.finish(key, flight, error=RuntimeError("Shared stream was closed before it finished"))
+            raise
+        except BaseException as e:
+            self.flights.finish(key, flight, error=e)
+            raise
+        response = "".join(chunks)
+        if self.cache is not None:
+            self.cache.set(key, response)
+        self.flights.finish(key, flight, response)
+
+    def similar_topic(self, template: str, topic: str) -> Tuple[str, Optional[str]]:
+        """Semantic cache namespace of template and the stored response to a topic close to topic, if any."""
+        namespace = self.cache_key(template)
+        if self.semantic_cache is None or self.bypass_cache:
+            return namespace, None
+        match = self.semantic_cache.lookup(namespace, topic)
+        return namespace, match[1] if match else None
+
+    def predict_topic(self, template: str, topic: str) -> str:
+        """predict() for template filled in with topic, answered by a near-identical topic when possible."""
+        namespace, response = self.similar_topic(template, topic)
+        if response is not None:
+            return response
+        response = self.predict(template.format(topic=topic))
+        if self.semantic_cache is not None:
+            self.semantic_cache.add(namespace, topic, response)
+        return response
+
+    def stream_topic(self, template: str, topic: str) -> Iterator[str]:
+        """stream() counterpart of predict_topic(); a semantic cache hit is yielded whole."""
+        namespace, response = self.similar_topic(template, topic)
+        if response is not None:
+            yield response
+            return
+        chunks = []
+        for chunk in self.stream(template.format(topic=topic)):
+            chunks.append(chunk)
+            yield chunk
+        if self.semantic_cache is not None:
+            self.semantic_cache.add(namespace, topic, "".join(chunks))
+
+
+def predict_with_metrics(llm, prompt: str, operation: str, accept: Optional[Callable[[str], bool]] = None) -> str:
+    """llm.predict(prompt), recorded as llm.<operation> with its latency, tokens and errors.
+
+    accept is passed on to an LLMClient, so only responses it approves are cached.
+    """
+    with metrics.track(f"llm.{operation}") as call:
+        response = llm.predict(prompt, accept) if accept is not None and isinstance(llm, LLMClient) else \
+            llm.predict(prompt)
+        call.add_tokens(prompt, response)
+    return response
+
+
+def stream_with_metrics(llm, prompt: str, operation: str) -> Iterator[str]:
+    """llm.stream(prompt), recorded as llm.<operation> once the stream is exhausted."""
+    with metrics.track(f"llm.{operation}") as call:
+        chunks = []
+        for chunk in llm.stream(prompt):
+            chunks.append(chunk)
+            yield chunk
+        call.add_tokens(prompt, "".join(chunks))
+
+
+def predict_topic_with_metrics(llm, topic: str, template: str = TOPIC_PROMPT) -> str:
+    """Points of topic from the template prompt, recorded as llm.get_topic_info.
+
+    With an LLMClient the points of a near-identical topic are reused when available.
+    """
+    prompt = template.format(topic=topic)
+    with metrics.track("llm.get_topic_info") as call:
+        response = llm.predict_topic(template, topic) if isinstance(llm, LLMClient) else llm.predict(prompt)
+        call.add_tokens(prompt, response)
+    return response
+
+
+def stream_topic_with_metrics(llm, topic: str, template: str = TOPIC_PROMPT) -> Iterator[str]:
+    """Streaming counterpart of predict_topic_with_metrics()."""
+    prompt = template.format(topic=topic)
+    with metrics.track("llm.get_topic_info") as call:
+        chunks = []
+        for chunk in llm.stream_topic(template, topic) if isinstance(llm, LLMClient) else llm.stream(prompt):
+            chunks.append(chunk)
+            yield chunk
+        call.add_tokens(prompt, "".join(chunks))
+
+
+def build_topic_prompt(topic: str) -> str:
+    """Prompt asking the LLM for the main points of a topic."""
+    return TOPIC_PROMPT.format(topic=topic)
+
+
+def parse_bullet_points(response: str) -> List[str]:
+    """Split an LLM response into bullet points."""
+    points = response.strip().split('\n')
+    return [point.strip('- ') for point in points if point.strip()]
+
+
+def build_imagery_prompt(item: str, info: str) -> str:
+    """Prompt asking the LLM to link one bullet point to one palace item."""
+    return f"""
+        Using the memory palace method, create a simple mental imagery to associate the phrase '{info}' with the item '{item}':
+        Make the associations interesting, obvious and in one sentence.
+        """
+
+
+def generate_imagery_results(items: Sequence[str], points: Sequence[str], llm,
+                             max_workers: int = MAX_CONCURRENT_REQUESTS) -> List[Tuple[Optional[str], Optional[Exception]]]:
+    """Ask for the imagery of every (item, point) pair concurrently, as (imagery, error) in palace order."""
+    return run_concurrently(
+        lambda item, point: predict_with_metrics(llm, build_imagery_prompt(item, point), "get_memorable_imagery"),
+        list(zip(items, points)), max_workers)
+
+
+def run_concurrently(fn: Callable[..., Any], args_list: Sequence[Tuple],
+                     max_workers: int = MAX_CONCURRENT_REQUESTS) -> List[Tuple[Any, Optional[Exception]]]:
+    """Call fn once per argument tuple on a thread pool.
+
+    Results are returned in the same order as args_list as (result, error) pairs,
+    so a failure for one item never discards the results of the others.
+    """
+    if not args_list:
+        return []
+
+    def call(args):
+        try:
+            return fn(*args), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(args_list)))) as executor:
+        return list(executor.map(call, args_list))
+
+
+def stream_concurrently(fn: Callable[..., Iterable[str]], args_list: Sequence[Tuple],
+                        max_workers: int = MAX_CONCURRENT_REQUESTS) -> Iterator[Tuple[int, Optional[str], Optional[Exception]]]:
+    """Consume one chunk stream per argument tuple on a thread pool.
+
+    Yields (index, chunk, None) for every chunk as soon as it arrives, and a final
+    (index, None, error) once the stream for args_list[index] ends, with error
+    None on success. Everything is yielded on the calling thread, so it is safe
+    to update Streamlit elements from the loop.
+    """
+    if not args_list:
+        return
+    events = queue.Queue()
+
+    def drain(index, args):
+        try:
+            for chunk in fn(*args):
+                events.put((index, chunk, None))
+            events.put((index, None, None))
+        except Exception as e:
+            events.put((index, None, e))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(args_list)))) as executor:
+        for index, args in enumerate(args_list):
+            executor.submit(drain, index, args)
+        remaining = len(args_list)
+        while remaining:
+            index, chunk, error = events.get()
+            if chunk is None:
+                remaining -= 1
+            yield index, chunk, error
+
+
+def build_batch_prompt(topic: str, items: Sequence[str], used_points: Sequence[str] = ()) -> str:
+    """Build one prompt asking for a bullet point and imagery for every palace item."""
+    numbered_items = "\n".join(f"{i + 1}. {item}" for i, item in enumerate(items))
+    prompt = f"""
+        Using the memory palace method, help me learn about '{topic}'.
+        For each numbered palace item below, give one important bullet point about the topic
+        (each item gets a different point, most important first) and a simple mental imagery
+        that associates the point with the item. Make the imagery interesting, obvious and in one sentence.
+
+        Palace items:
+        {numbered_items}
+        """
+    if used_points:
+        prompt += "\n        Do not repeat these points:\n" + "\n".join(f"        - {p}" for p in used_points) + "\n"
+    prompt += """
+        Respond only with a JSON array containing one object per item, in the same order,
+        each with the keys "item", "point" and "imagery".
+        """
+    return prompt
+
+
+def parse_batch_response(response: str, items: Sequence[str]) -> Dict[int, Dict[str, str]]:
+    """Parse a batched JSON response and validate it against the requested items.
+
+    Returns the valid records keyed by their position in items; entries that are
+    missing, malformed or name an unknown item are left out.
+    """
+    start, end = response.find('['), response.rfind(']')
+    if start == -1 or end < start:
+        return {}
+    try:
+        records = json.loads(response[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(records, list):
+        return {}
+
+    wanted = [item.strip().lower() for item in items]
+    parsed = {}
+    for position, record in enumerate(records):
+        if not isinstance(record, dict):
+            continue
+        point, imagery = record.get("point"), record.get("imagery")
+        if not isinstance(point, str) or not point.strip() or not isinstance(imagery, str) or not imagery.strip():
+            continue
+        name = str(record.get("item", "")).strip().lower()
+        # Prefer the positional match, fall back to the first unfilled item with the same name
+        if position < len(wanted) and wanted[position] == name and position not in parsed:
+            index = position
+        else:
+            index = next((i for i, w in enumerate(wanted) if w == name and i not in parsed), None)
+        if index is not None:
+            parsed[index] = {"item": items[index], "point": point.strip(), "imagery": imagery.strip()}
+    return parsed
+
+
+def generate_associations_batched(topic: str, items: Sequence[str],
+                                  predict: Callable[[str, Callable[[str], bool]], str],
+                                  max_retries: int = 2) -> List[Optional[Dict[str, str]]]:
+    """Generate every {item, point, imagery} record for a palace with a single LLM request.
+
+    Only entries that come back missing or malformed are requested again, up to
+    max_retries times. The result is aligned with items; entries that never
+    arrived are None. predict(prompt, accept) is given a check that a response
+    parses, so a caching predict can keep an unusable reply out of its cache
+    and a retry with the same prompt reaches the LLM again.
+    """
+    records = {}
+    for _ in range(max_retries + 1):
+        missing = [i for i in range(len(items)) if i not in records]
+        if not missing:
+            break
+        missing_items = [items[i] for i in missing]
+        used_points = [records[i]["point"] for i in sorted(records)]
+        response = predict(build_batch_prompt(topic, missing_items, used_points),
+                           lambda reply: bool(parse_batch_response(reply, missing_items)))
+        for position, record in parse_batch_response(response, missing_items).items():
+            records[missing[position]] = record
+    return [records.get(i) for i in range(len(items))]
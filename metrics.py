@@ -0,0 +1,176 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+# Latency histogram bucket upper bounds in milliseconds
+BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+METRICS_DIR = os.environ.get("MEMORY_PALACE_METRICS_DIR", "metrics")
+EXPORT_INTERVAL = float(os.environ.get("MEMORY_PALACE_METRICS_INTERVAL", "15"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token), good enough for trends."""
+    return (len(text) + 3) // 4 if text else 0
+
+
+class OperationStats:
+    """Latency histogram plus error and token counters for one operation."""
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def observe(self, elapsed_ms: float, error: bool, prompt_tokens: int, completion_tokens: int):
+        index = next((i for i, bound in enumerate(BUCKETS_MS) if elapsed_ms <= bound), len(BUCKETS_MS))
+        self.bucket_counts[index] += 1
+        self.count += 1
+        self.errors += int(error)
+        self.total_ms += elapsed_ms
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return None
+        target, seen = q * self.count, 0
+        for bound, bucket_count in zip(BUCKETS_MS + (float("inf"),), self.bucket_counts):
+            seen += bucket_count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "buckets": dict(zip([str(b) for b in BUCKETS_MS] + ["+Inf"], self.bucket_counts)),
+        }
+
+
+class CallRecord:
+    """Handed to a tracked block so it can attach token counts."""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add_tokens(self, prompt: str = "", completion: str = ""):
+        self.prompt_tokens += estimate_tokens(prompt)
+        self.completion_tokens += estimate_tokens(completion)
+
+
+class MetricsRegistry:
+    """Process-wide latency, error and token metrics for LLM calls and SQL queries."""
+
+    def __init__(self):
+        self.operations: Dict[str, OperationStats] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name: str, elapsed_ms: float, error: bool = False,
+                prompt_tokens: int = 0, completion_tokens: int = 0):
+        with self.lock:
+            if name not in self.operations:
+                self.operations[name] = OperationStats()
+            self.operations[name].observe(elapsed_ms, error, prompt_tokens, completion_tokens)
+
+    @contextmanager
+    def track(self, name: str) -> Iterator[CallRecord]:
+        record = CallRecord()
+        started = time.perf_counter()
+        error = False
+        try:
+            yield record
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(name, (time.perf_counter() - started) * 1000, error,
+                         record.prompt_tokens, record.completion_tokens)
+
+    def timed(self, name: str):
+        """Decorator recording every call of the wrapped function under name."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.track(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self.lock:
+            return {name: stats.to_dict() for name, stats in sorted(self.operations.items())}
+
+    def to_prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        with self.lock:
+            operations = sorted(self.operations.items())
+            lines = ["# TYPE memory_palace_operation_duration_ms histogram"]
+            for name, stats in operations:
+                cumulative = 0
+                for bound, bucket_count in zip([str(b) for b in BUCKETS_MS] + ["+Inf"], stats.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f'memory_palace_operation_duration_ms_bucket{{operation="{name}",le="{bound}"}} '
+                                 f'{cumulative}')
+                lines.append(f'memory_palace_operation_duration_ms_sum{{operation="{name}"}} {stats.total_ms:.3f}')
+                lines.append(f'memory_palace_operation_duration_ms_count{{operation="{name}"}} {stats.count}')
+            lines.append("# TYPE memory_palace_operation_errors_total counter")
+            for name, stats in operations:
+                lines.append(f'memory_palace_operation_errors_total{{operation="{name}"}} {stats.errors}')
+            lines.append("# TYPE memory_palace_operation_tokens_total counter")
+            for name, stats in operations:
+                for kind, tokens in (("prompt", stats.prompt_tokens), ("completion", stats.completion_tokens)):
+                    lines.append(f'memory_palace_operation_tokens_total{{operation="{name}",kind="{kind}"}} {tokens}')
+        return "\n".join(lines) + "\n"
+
+    def write_files(self, directory: str = METRICS_DIR):
+        """Write metrics.prom and metrics.json into directory, replacing them atomically."""
+        os.makedirs(directory, exist_ok=True)
+        for file_name, text in (("metrics.prom", self.to_prometheus()),
+                                ("metrics.json", json.dumps(self.snapshot(), indent=2))):
+            path = os.path.join(directory, file_name)
+            with open(path + ".tmp", "w") as f:
+                f.write(text)
+            os.replace(path + ".tmp", path)
+
+
+registry = MetricsRegistry()
+track = registry.track
+timed = registry.timed
+
+_exporter_started = False
+_exporter_lock = threading.Lock()
+
+
+def start_file_exporter(directory: str = METRICS_DIR, interval: float = EXPORT_INTERVAL):
+    """Rewrite the metrics files every interval seconds from a daemon thread; safe to call on every rerun."""
+    global _exporter_started
+    with _exporter_lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+
+    def export_forever():
+        while True:
+            time.sleep(interval)
+            try:
+                registry.write_files(directory)
+            except OSError:
+                pass
+
+    threading.Thread(target=export_forever, name="metrics-exporter", daemon=True).start()
@@ -1,15 +1,28 @@
 import streamlit as st
 from streamlit_tags import st_tags
-from langchain.chains import LLMChain
-from langchain_community.llms import OpenAI
-from langchain.prompts import PromptTemplate
-from database_operations import DatabaseOperations
+from association_format import format_association_content
+from database_operations import PAGE_SIZE, DatabaseOperations
+from generation_jobs import get_job_queue, parse_topic_rows
+from llm_cache import get_llm_cache
+from llm_operations import (LLMClient, build_imagery_prompt, generate_associations_batched, generate_imagery_results,
+                            openai_llm, parse_bullet_points, predict_topic_with_metrics, predict_with_metrics,
+                            stream_concurrently, stream_topic_with_metrics, stream_with_metrics)
+import metrics
+from rate_limit import llm_limiter
+from single_flight import llm_flights
+from retention import get_retention_reports, start_retention
+from semantic_cache import get_semantic_cache
 import json
 import os
+import time
 
 # Initialize database
 db = DatabaseOperations()
 
+# Seconds between refreshes of the generation jobs panel while a job is unfinished
+JOBS_REFRESH_SECONDS = 2
+FINISHED_JOB_STATUSES = ("done", "failed")
+
 def display_instructions():
     st.markdown("""
     # Memory Palace App: User Guide
@@ -29,6 +42,7 @@ def display_instructions():
       1. Go to the "Save/Load Data" tab
       2. Click "Download Data" to save your current data as a JSON file
       3. When you return, use the "Load Data" option to upload your saved file
+      4. Later saves can use "Download Changes" for only what changed since your last download; load the full file first, then each changes file
 
     ## How to Use the App
 
@@ -40,50 +54,204 @@ def display_instructions():
     Remember to save your data regularly, especially after making significant changes!
     """)
 
+def remember_saved_token(token):
+    st.session_state.last_saved_token = token
+
 def save_data():
-    data = db.export_data()
+    token, export_json = db.get_export_json()
     st.download_button(
         label="Download Data",
-        data=json.dumps(data, indent=2),
+        data=export_json,
         file_name="memory_palace_data.json",
-        mime="application/json"
+        mime="application/json",
+        on_click=remember_saved_token,
+        args=(token,)
+    )
+
+    # Only the rows added since a token, which loads on top of the full file
+    since = int(st.number_input("Changes since token", min_value=0, step=1,
+                                value=st.session_state.get('last_saved_token', 0),
+                                help="Filled in with the token of your last download."))
+    delta_token, changed, delta_json = db.get_delta_json(since)
+    st.download_button(
+        label="Download Changes",
+        data=delta_json,
+        file_name=f"memory_palace_changes_{since}_{delta_token}.json",
+        mime="application/json",
+        on_click=remember_saved_token,
+        args=(delta_token,),
+        disabled=not changed
     )
+    st.caption(f"{changed} changed records since token {since}; current token {delta_token}.")
 
 def load_data():
     uploaded_file = st.file_uploader("Choose a file to upload", type="json")
-    if uploaded_file is not None:
+    if uploaded_file is None:
+        return
+    # The uploader keeps its file across reruns; import each upload once, and record its token only
+    # then, since later reruns would count newer edits as saved
+    if st.session_state.get('loaded_file_id') != uploaded_file.file_id:
         data = json.load(uploaded_file)
-        db.import_data(data)
-        st.success("Data loaded successfully!")
+        progress = st.progress(0.0, text="Loading data...")
+
+        def show_progress(done, total):
+            progress.progress(done / total if total else 1.0, text=f"Loaded {done} of {total} records")
+
+        db.import_data(data, progress_callback=show_progress)
+        progress.empty()
+        st.session_state.loaded_file_id = uploaded_file.file_id
+        st.session_state.last_saved_token = db.get_change_token()
+        if data.get("format") == "delta":
+            st.session_state.load_message = f"Changes up to token {data.get('token')} applied successfully!"
+        else:
+            st.session_state.load_message = "Data loaded successfully!"
+    st.success(st.session_state.load_message)
 
 
 # Function to get topic information from the LLM
 def get_topic_info(topic, llm):
     try:
-        topic_prompt = PromptTemplate(
-            input_variables=["topic"],
-            template=f"Provide important bullet points about {{topic}}:"
-        )
-        topic_chain = LLMChain(llm=llm, prompt=topic_prompt)
-        response = topic_chain.run({"topic": topic})
-        points = response.strip().split('\n')
-        return [point.strip('- ') for point in points if point.strip()]
+        response = predict_topic_with_metrics(llm, topic)
+        return parse_bullet_points(response)
     except Exception as e:
         st.error(f"Error getting topic information: {str(e)}")
         return []
 
-# Function to get memorable imagery for an item
-def get_memorable_imagery(item, info, llm):
+# Generate imagery for every (item, point) pair in parallel, keeping the palace order
+def generate_imagery(items, bullet_points, llm):
+    results = generate_imagery_results(items, bullet_points, llm)
+    imagery_list = []
+    for item, (imagery, error) in zip(items, results):
+        if error is not None:
+            st.error(f"Error getting memorable imagery for '{item}': {str(error)}")
+            imagery = ""
+        imagery_list.append(imagery)
+    return imagery_list
+
+# Generate points and imagery for the whole palace in one request
+def get_batched_associations(topic, items, llm):
+    try:
+        records = generate_associations_batched(
+            topic, items,
+            lambda prompt, accept: predict_with_metrics(llm, prompt, "generate_associations_batched", accept))
+    except Exception as e:
+        st.error(f"Error generating associations: {str(e)}")
+        return [], []
+    bullet_points, imagery_list = [], []
+    for item, record in zip(items, records):
+        if record is None:
+            st.error(f"No valid association was returned for '{item}'.")
+            record = {"point": "", "imagery": ""}
+        bullet_points.append(record["point"])
+        imagery_list.append(record["imagery"])
+    return bullet_points, imagery_list
+
+# Markdown for one palace item and its association
+def format_association(item, point, imagery):
+    return f"**{item}**:\n {point} \n\n(Memorable Imagery: {imagery})"
+
+# Stream points and imagery into their item slots as tokens arrive
+def stream_associations(topic, items, llm):
+    points_slot = st.empty()
+    response = ""
     try:
-        prompt = f"""
-        Using the memory palace method, create a simple mental imagery to associate the phrase '{info}' with the item '{item}':
-        Make the associations interesting, obvious and in one sentence.
-        """
-        response = llm.predict(prompt)
-        return response
+        for chunk in stream_topic_with_metrics(llm, topic):
+            response += chunk
+            points_slot.markdown(response)
     except Exception as e:
-        st.error(f"Error getting memorable imagery: {str(e)}")
-        return ""
+        st.error(f"Error getting topic information: {str(e)}")
+        return [], []
+    points_slot.empty()
+    bullet_points = parse_bullet_points(response)
+
+    pairs = list(zip(items, bullet_points))
+    imagery_list = [""] * len(pairs)
+    slots = [st.empty() for _ in pairs]
+    for slot, (item, point) in zip(slots, pairs):
+        slot.markdown(format_association(item, point, "..."))
+
+    streams = stream_concurrently(
+        lambda item, point: stream_with_metrics(llm, build_imagery_prompt(item, point), "get_memorable_imagery"), pairs)
+    for index, chunk, error in streams:
+        item, point = pairs[index]
+        if error is not None:
+            st.error(f"Error getting memorable imagery for '{item}': {str(error)}")
+            imagery_list[index] = ""
+        elif chunk is not None:
+            imagery_list[index] += chunk
+        slots[index].markdown(format_association(item, point, imagery_list[index]))
+    return [point for _, point in pairs], imagery_list
+
+# Optional sidebar panel with the latency, error and token metrics of this process
+def display_diagnostics():
+    if not st.sidebar.checkbox("Show diagnostics", key='show_diagnostics'):
+        return
+    snapshot = metrics.registry.snapshot()
+    if not snapshot:
+        st.sidebar.caption("No calls recorded yet.")
+        return
+    st.sidebar.dataframe(
+        [{"operation": name, "calls": stats["count"], "errors": stats["errors"], "avg ms": stats["avg_ms"],
+          "p50 ms": stats["p50_ms"], "p95 ms": stats["p95_ms"],
+          "tokens": stats["prompt_tokens"] + stats["completion_tokens"]}
+         for name, stats in snapshot.items()],
+        hide_index=True
+    )
+    st.sidebar.caption(f"Also written to {metrics.METRICS_DIR}/metrics.prom and metrics.json")
+    for report in get_retention_reports():
+        st.sidebar.caption(f"Last retention run: {report['expired_sessions']} expired sessions removed, "
+                           f"{report['reclaimed_bytes'] / 1024:.0f} KiB reclaimed")
+
+# Whether any of the session's jobs or batches is still generating or saving
+def has_unfinished_jobs(session_jobs, batches):
+    return (any(job['status'] not in FINISHED_JOB_STATUSES for job in session_jobs)
+            or any(not batch['finished'] for batch in batches))
+
+# Progress of the session's generation jobs and bulk batches
+def display_jobs(jobs, polling):
+    session_jobs = jobs.get_jobs(db.session_id)
+    batches = jobs.get_batches(db.session_id)
+    if polling and not has_unfinished_jobs(session_jobs, batches):
+        # Rerun the whole page once, so the new associations show and the panel stops polling
+        st.rerun()
+    if not (session_jobs or batches):
+        return
+    st.subheader("Generation jobs")
+    for batch in batches:
+        label = (f"{batch['name']}: {batch['done']} of {batch['total']} topics saved"
+                 f"{', ' + str(batch['failed']) + ' failed' if batch['failed'] else ''}")
+        st.progress((batch['done'] + batch['failed']) / batch['total'], text=label)
+        st.caption(f"{batch['topics_per_min']:.1f} topics/min, {batch['items_per_s']:.1f} items/s "
+                   f"over {batch['elapsed_s']:.0f}s")
+    for job in session_jobs:
+        label = f"{job['topic']} in {job['palace_name']} ({job['category_name']}): {job['status']}"
+        st.progress(job['done'] / job['total'] if job['total'] else 0.0, text=label)
+        if job['failed']:
+            st.caption(f"{job['failed']} of {job['total']} items failed and were saved without imagery.")
+        if job['error']:
+            st.error(job['error'])
+    st.write("---")
+
+# Rows of the current page of a keyset-paginated list, with Previous/Next buttons under them.
+# load(after_id, limit) returns rows whose first column is the id; the id each visited page
+# starts after is kept in session state under key, so Previous can step back.
+def keyset_page(key, load):
+    starts = st.session_state.setdefault(key, [0])
+    rows = load(starts[-1], PAGE_SIZE + 1)
+    has_next = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+    if len(starts) > 1 or has_next:
+        col1, col2, col3 = st.columns([1, 2, 1])
+        col1.button("Previous", key=f"{key}_previous", disabled=len(starts) == 1, on_click=starts.pop)
+        col2.caption(f"Page {len(starts)}")
+        col3.button("Next", key=f"{key}_next", disabled=not has_next,
+                    on_click=starts.append, args=(rows[-1][0] if rows else starts[-1],))
+    return rows
+
+# One client per API key and configuration, shared by reruns and sessions; langchain loads on the first prompt
+@st.cache_resource(show_spinner=False)
+def get_llm(openai_api_key, temperature):
+    return openai_llm(openai_api_key, temperature)
 
 # Main app
 def main():
@@ -96,11 +264,29 @@ def main():
     # Set up the OpenAI API key input
     openai_api_key = st.text_input('OpenAI API Key', type='password', disabled=True)
 
-    try:
-        llm = OpenAI(temperature=0.6, openai_api_key=openai_api_key)
-    except Exception as e:
-        st.error(f"Error initializing OpenAI: {str(e)}")
-        return
+    llm = get_llm(openai_api_key, 0.6)
+
+    llm_cache = get_llm_cache()
+    bypass_cache = st.sidebar.checkbox("Bypass response cache", key='bypass_cache',
+                                       help="Always ask the LLM for fresh output.")
+    semantic_cache = get_semantic_cache()
+    llm = LLMClient(llm, llm_cache, bypass_cache=bypass_cache, semantic_cache=semantic_cache)
+    cache_stats = llm_cache.stats()
+    st.sidebar.caption(f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                       f"{cache_stats['entries']} entries")
+    semantic_stats = semantic_cache.stats()
+    st.sidebar.caption(f"Similar-topic cache: {semantic_stats['hits']} hits, {semantic_stats['misses']} misses, "
+                       f"{semantic_stats['entries']} topics")
+    flight_stats = llm_flights.stats()
+    st.sidebar.caption(f"Shared in-flight calls: {flight_stats['shared']} saved of "
+                       f"{flight_stats['calls'] + flight_stats['shared']} requests")
+    limiter_stats = llm_limiter.stats()
+    st.sidebar.caption(f"LLM rate limiter: {limiter_stats['retries']} retries, {limiter_stats['rate_limited']} "
+                       f"throttled, {limiter_stats['failures']} failed, up to {limiter_stats['limit']} calls at once")
+    metrics.start_file_exporter()
+    start_retention(db.db_name)
+    jobs = get_job_queue(db.db_name)
+    jobs.resume_incomplete(llm)
 
     # Tabs for different functionalities
     tab1, tab2, tab3, tab4 = st.tabs(["Create Memory Palace", "View Results", "Manage Palaces", "Save/Load Data"])
@@ -120,7 +306,7 @@ def main():
         # Load items if an existing palace is selected
         if palace_name:
             if selected_palace:
-                palace_id = next(palace[0] for palace in palaces if palace[1] == selected_palace)
+                palace_id = db.get_palace_id(selected_palace)
                 items = db.get_palace_items(palace_id)
 
             items = st_tags(
@@ -133,29 +319,48 @@ def main():
 
         # Category selection or creation
         categories = db.get_categories()
+        category_ids = {name: cat_id for cat_id, name in categories}
         category_options = [""] + [category[1] for category in categories]
         selected_category = st.selectbox('Select Category', category_options, key='select_category')
         new_category = st.text_input('Or, add a new category', key='new_category', disabled=bool(selected_category))
         category = selected_category if selected_category else new_category
 
         topic = st.text_area('Enter the topic to learn about', max_chars=100, key='topic')
+        background = st.checkbox('Run in the background', value=True, key='background',
+                                 help="Keeps generating when the page reruns; follow progress in View Results.")
+        batched = st.checkbox('Generate the whole palace in a single request', key='batched', disabled=background,
+                              help="Uses one LLM call for all items instead of one call per item.")
+        stream = st.checkbox('Show results as they are generated', value=True, key='stream',
+                             disabled=background or batched)
 
         # Generate Associations button disabled if conditions are not met
         generate_button_disabled = not palace_name or len(items) < 5 or not category or not topic
 
-        if st.button("Generate Associations", key='generate', disabled=generate_button_disabled):
+        generate = st.button("Generate Associations", key='generate', disabled=generate_button_disabled)
+        if generate and background:
+            jobs.submit(db.session_id, topic, palace_name, category, items, llm)
+            st.success("Generation started. Follow its progress in the View Results tab.")
+        elif generate:
             st.success("Making Associations......")
-            bullet_points = get_topic_info(topic, llm)
-            imagery_list = [get_memorable_imagery(item, point, llm) for item, point in zip(items, bullet_points)]
-
-            # Display the associations
             st.markdown(f"**Memory Palace: {palace_name}**")
             st.markdown(f"**Topic: {topic}**")
             st.markdown("---")
-            content = ""
-            for item, point, imagery in zip(items, bullet_points, imagery_list):
-                st.markdown(f"**{item}**:\n {point} \n\n(Memorable Imagery: {imagery})")
-                content += f"{item}: {point} (Imagery: {imagery})\n"
+            started = time.perf_counter()
+            if batched:
+                bullet_points, imagery_list = get_batched_associations(topic, items, llm)
+            elif stream:
+                bullet_points, imagery_list = stream_associations(topic, items, llm)
+            else:
+                bullet_points = get_topic_info(topic, llm)
+                imagery_list = generate_imagery(items, bullet_points, llm)
+
+            # Display the associations
+            entries = list(zip(items, bullet_points, imagery_list))
+            if batched or not stream:
+                for item, point, imagery in entries:
+                    st.markdown(format_association(item, point, imagery))
+            content = format_association_content(entries)
+            st.caption(f"Generated in {time.perf_counter() - started:.1f}s")
 
             # Save to database
             if not selected_palace:  # Only save if it's a new palace
@@ -165,16 +370,49 @@ def main():
             if not selected_category:
                 category_id = db.add_category(category)
             else:
-                category_id = next(cat[0] for cat in categories if cat[1] == selected_category)
+                category_id = category_ids[selected_category]
 
-            association_id = db.save_association(topic, category_id, palace_id, content)
+            association_id = db.save_association(topic, category_id, palace_id, content, entries)
 
             if association_id:
                 st.success(f"Associations saved successfully.")
 
+        with st.expander("Bulk generation from a topic list"):
+            st.write("Upload a CSV with topic, category and palace columns (plus items, separated by "
+                     "semicolons, for palaces that do not exist yet), or a JSON list with the same keys.")
+            topic_file = st.file_uploader("Topic list", type=["csv", "json"], key='topic_file')
+            if topic_file is not None:
+                try:
+                    rows = parse_topic_rows(topic_file.name, topic_file.getvalue())
+                except ValueError as e:
+                    st.error(f"Invalid topic list: {str(e)}")
+                    rows = []
+                if rows:
+                    st.dataframe([{k: v for k, v in row.items() if k != "items"} for row in rows],
+                                 use_container_width=True)
+                    if st.button(f"Generate all {len(rows)} topics", key='generate_bulk'):
+                        try:
+                            jobs.submit_batch(db.session_id, topic_file.name, rows, llm)
+                            st.success("Bulk generation started. Follow its progress in the View Results tab.")
+                        except ValueError as e:
+                            st.error(str(e))
+
     with tab2:
         st.header("View Associations")
 
+        # While jobs are unfinished only the panel reruns, every few seconds, to follow their progress
+        polling = has_unfinished_jobs(jobs.get_jobs(db.session_id), jobs.get_batches(db.session_id))
+        st.experimental_fragment(display_jobs, run_every=JOBS_REFRESH_SECONDS if polling else None)(jobs, polling)
+
+        search_query = st.text_input("Search topics, items, points and imagery", key='search_query')
+        if search_query:
+            results = db.search(search_query)
+            if not results:
+                st.write("No matches found.")
+            for association_id, topic, category_name, item, snippet in results:
+                st.markdown(f"**{topic}** ({category_name}) - *{item}*: {snippet}")
+            st.write("---")
+
         categories = db.get_categories()
         if not categories:
             st.write("No categories found.")
@@ -182,38 +420,35 @@ def main():
             selected_category = st.selectbox("Select a Category", [cat[1] for cat in categories])
 
             if selected_category:
-                category_id = next(cat[0] for cat in categories if cat[1] == selected_category)
-                associations = db.get_associations(category_id)
+                category_id = {name: cat_id for cat_id, name in categories}[selected_category]
+                # Only a page of topics is listed; content and entries are loaded for the selected one
+                summaries = keyset_page(f'association_pages_{category_id}',
+                                        lambda after_id, limit: db.get_association_summaries(category_id, after_id, limit))
+                topics = {summary[0]: summary[1] for summary in summaries}
 
-                if not associations:
+                if not summaries:
                     st.write("No association files found in this category.")
                 else:
-                    selected_association = st.selectbox("Select an Association", [assoc[1] for assoc in associations])
+                    selected_association = st.selectbox("Select an Association", list(topics),
+                                                        format_func=topics.get)
+                    association = db.get_association(selected_association) if selected_association else None
 
-                    if selected_association:
-                        association = next(assoc for assoc in associations if assoc[1] == selected_association)
-                        topic, palace_id, content = association[1], association[2], association[3]
+                    if association:
+                        topic, palace_id, content, entries = association[1:]
 
-                        palace_name = next(palace[1] for palace in db.get_palaces() if palace[0] == palace_id)
+                        palace_name = db.get_palace_name(palace_id)
 
                         st.markdown(f"### Topic: {topic}")
                         st.markdown(f"**Memory Palace: {palace_name}**")
                         st.write("")
 
-                        for line in content.strip().split('\n'):
-                            if line:
-                                try:
-                                    item_part, rest = line.split(':', 1)
-                                    bullet_part, imagery_part = rest.rsplit('(Imagery:', 1)
-                                    bullet = bullet_part.strip()
-                                    imagery = imagery_part.strip(') ').strip()
-                                    item = item_part.strip()
-                                    st.markdown(f"**{item}**")
-                                    st.write(f"{bullet}")
-                                    st.write(f"*Imagery:* {imagery}")
-                                    st.write("---")
-                                except Exception as e:
-                                    st.write(line)
+                        for item, bullet, imagery in entries:
+                            st.markdown(f"**{item}**")
+                            st.write(f"{bullet}")
+                            st.write(f"*Imagery:* {imagery}")
+                            st.write("---")
+                        if not entries:
+                            st.write(content)
 
     with tab3:
         st.header("Manage Palaces")
@@ -243,14 +478,15 @@ def main():
             else:
                 st.error("Please enter both a palace name and items.")
 
-        # Display the current palace data
+        # Display the current palace data a page at a time, with the items of one palace
         st.subheader("Current Palace Data")
-        palaces = db.get_palaces()
-        for palace in palaces:
-            st.write(f"Palace: {palace[1]}")
-            items = db.get_palace_items(palace[0])
-            st.write(f"Items: {', '.join(items)}")
-            st.write("---")
+        summaries = keyset_page('palace_pages', db.get_palace_summaries)
+        for palace_id, name, item_count in summaries:
+            st.write(f"Palace: {name} ({item_count} items)")
+        if summaries:
+            names = {palace_id: name for palace_id, name, _ in summaries}
+            shown_palace = st.selectbox("Show the items of", list(names), format_func=names.get, key='shown_palace')
+            st.write(f"Items: {', '.join(db.get_palace_items(shown_palace))}")
 
     with tab4:
         st.header("Save or Load Your Data")
@@ -263,7 +499,10 @@ def main():
 
         with col2:
             st.subheader("Load Data")
-            st.write("Upload a previously saved JSON file:")
+            st.write("Upload a previously saved JSON file or a changes file:")
             load_data()
+
+    # Rendered last so it includes the calls made during this run
+    display_diagnostics()
 if __name__ == "__main__":
     main()
\ No newline at end of file
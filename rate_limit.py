@@ -0,0 +1,263 @@
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Provider quotas shared by every session of the process
+REQUESTS_PER_MINUTE = float(os.environ.get("MEMORY_PALACE_LLM_RPM", "3000"))
+TOKENS_PER_MINUTE = float(os.environ.get("MEMORY_PALACE_LLM_TPM", "250000"))
+# Bounds of the adaptive limit on LLM calls in flight at once
+MIN_IN_FLIGHT = 1
+MAX_IN_FLIGHT = int(os.environ.get("MEMORY_PALACE_LLM_MAX_IN_FLIGHT", "16"))
+# Seconds a call may spend waiting, running and retrying before its last error is raised
+CALL_DEADLINE = float(os.environ.get("MEMORY_PALACE_LLM_DEADLINE", "60"))
+MAX_ATTEMPTS = int(os.environ.get("MEMORY_PALACE_LLM_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 20.0
+# Completion tokens reserved per call before its real size is known (the OpenAI completion default)
+COMPLETION_TOKENS_ESTIMATE = 256
+# A successful call this many times slower than the running average counts as congestion
+LATENCY_SPIKE_FACTOR = 3.0
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = ("RateLimit", "Timeout", "APIConnection", "ServiceUnavailable", "InternalServer")
+
+
+class DeadlineExceeded(TimeoutError):
+    """The limiter could not start a call before its deadline."""
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    return error_status(error) == 429 or "RateLimit" in type(error).__name__
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed call may succeed when repeated: throttling, timeouts, dropped connections and 5xx."""
+    if error_status(error) in RETRYABLE_STATUS_CODES:
+        return True
+    return isinstance(error, (TimeoutError, ConnectionError)) or any(
+        name in type(error).__name__ for name in RETRYABLE_ERROR_NAMES)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the provider asked us to wait, from a Retry-After header or attribute."""
+    value = getattr(error, "retry_after", None)
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if value is None and headers is not None:
+        value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Refills at rate_per_minute, holding at most one minute's worth."""
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self.available = rate_per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float, deadline: float):
+        """Take amount, sleeping until it has refilled; TimeoutError if that would pass deadline."""
+        # Calls larger than the bucket would never fit, so they wait for a full bucket instead
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                wait = (amount - self.available) / self.rate
+            if now + wait > deadline:
+                raise DeadlineExceeded("LLM rate limit would be exceeded before the call deadline")
+            time.sleep(wait)
+
+    def refund(self, amount: float):
+        with self.lock:
+            self.available = min(self.capacity, self.available + amount)
+
+    def drain(self):
+        """Empty the bucket after the provider reported throttling the client did not expect."""
+        with self.lock:
+            self.available = 0.0
+            self.updated = time.monotonic()
+
+
+class AdaptiveConcurrency:
+    """Limit on calls in flight that grows additively and halves on congestion (AIMD)."""
+
+    def __init__(self, initial: int = 4, minimum: int = MIN_IN_FLIGHT, maximum: int = MAX_IN_FLIGHT):
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.average_latency: Optional[float] = None
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self, deadline: float):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceeded("No LLM call slot became free before the call deadline")
+                self.condition.wait(remaining)
+            self.in_flight += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def on_success(self, latency: Optional[float] = None):
+        """Grow the limit after a successful call; latency is left out when it says nothing about the provider."""
+        with self.condition:
+            spike = False
+            if latency is not None:
+                spike = self.average_latency is not None and latency > LATENCY_SPIKE_FACTOR * self.average_latency
+                self.average_latency = latency if self.average_latency is None else (
+                    0.9 * self.average_latency + 0.1 * latency)
+            if spike:
+                self._decrease()
+            else:
+                # About +1 per limit's worth of successes
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+                self.condition.notify_all()
+
+    def on_congestion(self):
+        with self.condition:
+            self._decrease()
+
+    def _decrease(self):
+        # One window of failures should halve the limit once, not once per failed call
+        now = time.monotonic()
+        if now - self.last_decrease < (self.average_latency or 1.0):
+            return
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit / 2)
+
+
+class RateLimiter:
+    """Client-side throttling and retries shared by every LLM call of the process.
+
+    Each attempt waits for a concurrency slot and for request and token budget,
+    then runs the call. Throttling, timeouts and server errors are retried with
+    full-jitter exponential backoff until MAX_ATTEMPTS or the call deadline.
+    """
+
+    def __init__(self, requests_per_minute: float = REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = TOKENS_PER_MINUTE, max_in_flight: int = MAX_IN_FLIGHT,
+                 deadline: float = CALL_DEADLINE, max_attempts: int = MAX_ATTEMPTS):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrency(maximum=max_in_flight)
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.counts = {"calls": 0, "retries": 0, "rate_limited": 0, "failures": 0}
+
+    def _count(self, name: str):
+        with self.lock:
+            self.counts[name] += 1
+
+    @contextmanager
+    def permit(self, tokens: int, deadline: float) -> Iterator[None]:
+        """Hold a concurrency slot plus request and token budget for one attempt."""
+        self.concurrency.acquire(deadline)
+        try:
+            self.requests.acquire(1, deadline)
+            self.tokens.acquire(tokens, deadline)
+            yield
+        finally:
+            self.concurrency.release()
+
+    def _backoff(self, attempt: int, error: BaseException, deadline: float) -> bool:
+        """Record a failed attempt and sleep before the next one; False when it should not be retried."""
+        if is_rate_limited(error):
+            self._count("rate_limited")
+            self.requests.drain()
+            self.concurrency.on_congestion()
+        if isinstance(error, DeadlineExceeded) or not is_retryable(error) or attempt + 1 >= self.max_attempts:
+            return False
+        delay = retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+        if time.monotonic() + delay > deadline:
+            return False
+        logger.info("Retrying LLM call in %.2fs after %r", delay, error)
+        self._count("retries")
+        time.sleep(delay)
+        return True
+
+    def call(self, fn: Callable[[], Any], tokens: int, deadline: Optional[float] = None) -> Any:
+        """Return fn() under the limits, retrying transient failures until deadline seconds have passed."""
+        deadline = time.monotonic() + (self.deadline if deadline is None else deadline)
+        self._count("calls")
+        attempt = 0
+        while True:
+            try:
+                with self.permit(tokens, deadline):
+                    started = time.monotonic()
+                    result = fn()
+                    self.concurrency.on_success(time.monotonic() - started)
+                return result
+            except Exception as e:
+                if not self._backoff(attempt, e, deadline):
+                    self._count("failures")
+                    raise
+            attempt += 1
+
+    def stream(self, start: Callable[[], Iterator[str]], tokens: int,
+               deadline: Optional[float] = None) -> Iterator[str]:
+        """Yield the chunks of start() under the limits; only failures before the first chunk are retried."""
+        deadline = time.monotonic() + (self.deadline if deadline is None else deadline)
+        self._count("calls")
+        attempt = 0
+        while True:
+            emitted = False
+            try:
+                with self.permit(tokens, deadline):
+                    for chunk in start():
+                        emitted = True
+                        yield chunk
+                    # A stream's duration includes however long the consumer took, so it is no latency signal
+                    self.concurrency.on_success()
+                return
+            except Exception as e:
+                if emitted or not self._backoff(attempt, e, deadline):
+                    self._count("failures")
+                    raise
+            attempt += 1
+
+    def refund_tokens(self, reserved: int, used: int):
+        """Return the part of a call's token reservation it did not use."""
+        if reserved > used:
+            self.tokens.refund(reserved - used)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            counts = dict(self.counts)
+        return dict(counts, limit=int(self.concurrency.limit), in_flight=self.concurrency.in_flight)
+
+
+# Shared by every session of the process, since the provider quota is per API key, not per session
+llm_limiter = RateLimiter()
@@ -0,0 +1,111 @@
+import copy
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+# Bytes of cached reads kept per process across every session; the least recently used go first
+READ_CACHE_BYTES = int(os.environ.get("MEMORY_PALACE_READ_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+
+def value_size(value: Any) -> int:
+    """Approximate memory held by a cached value: the size of its pickle."""
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+class ReadCacheBudget:
+    """A byte limit shared by session caches, evicting their least recently used values.
+
+    The caches sharing a budget also share its lock, so a value evicted from one
+    session's cache is never read by another thread halfway through.
+    """
+
+    def __init__(self, max_bytes: int = READ_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        self.entries: "OrderedDict[Tuple[SessionReadCache, Hashable], int]" = OrderedDict()
+        self.bytes = 0
+
+    def touch(self, cache: "SessionReadCache", key: Hashable):
+        self.entries.move_to_end((cache, key))
+
+    def add(self, cache: "SessionReadCache", key: Hashable, size: int):
+        self.remove(cache, key)
+        self.entries[(cache, key)] = size
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            (evicted_cache, evicted_key), evicted_size = self.entries.popitem(last=False)
+            evicted_cache.values.pop(evicted_key, None)
+            self.bytes -= evicted_size
+
+    def remove(self, cache: "SessionReadCache", key: Hashable):
+        self.bytes -= self.entries.pop((cache, key), 0)
+
+
+class SessionReadCache:
+    """Read results for one session, kept until a write invalidates them or the budget evicts them.
+
+    Values are stored and returned as deep copies so callers can never mutate
+    the cached state.
+    """
+
+    def __init__(self, budget: Optional[ReadCacheBudget] = None):
+        self.budget = budget or ReadCacheBudget()
+        self.values: Dict[Hashable, Any] = {}
+        self.generation = 0
+        self.lock = self.budget.lock
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        with self.lock:
+            if key in self.values:
+                self.budget.touch(self, key)
+                return copy.deepcopy(self.values[key])
+            generation = self.generation
+        value = load()
+        size = value_size(value)
+        with self.lock:
+            # Skip storing if a write happened while loading; the value may already be stale
+            if generation == self.generation and size <= self.budget.max_bytes:
+                self.values[key] = copy.deepcopy(value)
+                self.budget.add(self, key, size)
+        return value
+
+    def invalidate(self, *keys: Hashable):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                if key in self.values:
+                    del self.values[key]
+                    self.budget.remove(self, key)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            for key in self.values:
+                self.budget.remove(self, key)
+            self.values.clear()
+
+
+_caches: Dict[Tuple[str, str], SessionReadCache] = {}
+_caches_lock = threading.Lock()
+_budget = ReadCacheBudget()
+
+
+def get_session_cache(db_name: str, session_id: str) -> SessionReadCache:
+    """Return the process-wide read cache for a session of db_name, sharing the process's byte budget."""
+    key = (os.path.abspath(db_name), session_id)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = SessionReadCache(_budget)
+        return _caches[key]
+
+
+def drop_session_caches(db_name: str, session_ids: Iterable[str]):
+    """Forget the cached reads of sessions whose rows were removed."""
+    path = os.path.abspath(db_name)
+    with _caches_lock:
+        caches = [_caches.pop((path, session_id), None) for session_id in session_ids]
+    for cache in caches:
+        if cache is not None:
+            cache.clear()
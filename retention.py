@@ -0,0 +1,188 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from db_connection import connect
+from read_cache import drop_session_caches
+
+logger = logging.getLogger(__name__)
+
+# Sessions idle for longer than this lose their rows
+SESSION_TTL = float(os.environ.get("MEMORY_PALACE_SESSION_TTL", str(24 * 3600)))
+# Seconds between background retention runs
+RETENTION_INTERVAL = float(os.environ.get("MEMORY_PALACE_RETENTION_INTERVAL", "3600"))
+# Expired sessions deleted per transaction, so writers are never blocked for long
+SESSION_BATCH_SIZE = 50
+# Free pages returned to the filesystem per incremental vacuum step
+VACUUM_PAGES = 1000
+# PRAGMA auto_vacuum value of incremental mode
+INCREMENTAL = 2
+
+# Each statement receives the JSON list of expired session ids as its only parameter
+DELETE_STATEMENTS = (
+    """
+    DELETE FROM association_entries WHERE association_id IN (
+        SELECT a.id FROM associations a
+        WHERE a.category_id IN (SELECT id FROM categories WHERE session_id IN (SELECT value FROM json_each(?1)))
+           OR a.palace_id IN (SELECT id FROM palaces WHERE session_id IN (SELECT value FROM json_each(?1)))
+    )
+    """,
+    """
+    DELETE FROM associations
+    WHERE category_id IN (SELECT id FROM categories WHERE session_id IN (SELECT value FROM json_each(?1)))
+       OR palace_id IN (SELECT id FROM palaces WHERE session_id IN (SELECT value FROM json_each(?1)))
+    """,
+    """
+    DELETE FROM items
+    WHERE palace_id IN (SELECT id FROM palaces WHERE session_id IN (SELECT value FROM json_each(?1)))
+    """,
+    """
+    DELETE FROM generation_job_results
+    WHERE job_id IN (SELECT id FROM generation_jobs WHERE session_id IN (SELECT value FROM json_each(?1)))
+    """,
+    "DELETE FROM generation_jobs WHERE session_id IN (SELECT value FROM json_each(?1))",
+    "DELETE FROM generation_batches WHERE session_id IN (SELECT value FROM json_each(?1))",
+    "DELETE FROM palaces WHERE session_id IN (SELECT value FROM json_each(?1))",
+    "DELETE FROM categories WHERE session_id IN (SELECT value FROM json_each(?1))",
+    "DELETE FROM change_log WHERE session_id IN (SELECT value FROM json_each(?1))",
+    "DELETE FROM sessions WHERE session_id IN (SELECT value FROM json_each(?1))",
+)
+
+
+class RetentionManager:
+    """Removes the rows of expired sessions and compacts the database file."""
+
+    def __init__(self, db_name: str = "memory_palace.db", ttl_seconds: float = SESSION_TTL,
+                 batch_size: int = SESSION_BATCH_SIZE):
+        self.db_name = db_name
+        self.ttl_seconds = ttl_seconds
+        self.batch_size = batch_size
+        self.last_report: Optional[Dict] = None
+        self.lock = threading.Lock()
+
+    def expire_sessions(self, conn: sqlite3.Connection) -> Dict[str, int]:
+        """Delete expired sessions batch by batch, one transaction per batch."""
+        expired_sessions = deleted_rows = 0
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Selected inside the write transaction so a session touched meanwhile is kept
+                session_ids = [row[0] for row in conn.execute(
+                    "SELECT session_id FROM sessions WHERE last_active < ? LIMIT ?",
+                    (time.time() - self.ttl_seconds, self.batch_size))]
+                if not session_ids:
+                    conn.rollback()
+                    break
+                payload = json.dumps(session_ids)
+                deleted_rows += sum(conn.execute(statement, (payload,)).rowcount for statement in DELETE_STATEMENTS)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            drop_session_caches(self.db_name, session_ids)
+            expired_sessions += len(session_ids)
+        return {"expired_sessions": expired_sessions, "deleted_rows": deleted_rows}
+
+    @staticmethod
+    def file_size(conn: sqlite3.Connection) -> int:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return conn.execute("PRAGMA page_count").fetchone()[0] * page_size
+
+    def compact(self, conn: sqlite3.Connection) -> int:
+        """Return free pages to the filesystem, refresh planner statistics and report the bytes reclaimed.
+
+        Files created before incremental auto-vacuum was enabled keep their free
+        pages for reuse until enable_incremental_vacuum converts them.
+        """
+        before = self.file_size(conn)
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == INCREMENTAL:
+            while conn.execute("PRAGMA freelist_count").fetchone()[0]:
+                conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+        conn.execute("PRAGMA optimize")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return before - self.file_size(conn)
+
+    def run_once(self) -> Dict:
+        """Expire idle sessions, compact the file and return a report of what was done."""
+        with self.lock:
+            started = time.time()
+            conn = connect(self.db_name)
+            try:
+                report = self.expire_sessions(conn)
+                report["reclaimed_bytes"] = self.compact(conn)
+            finally:
+                conn.close()
+            report["finished_at"] = time.time()
+            report["duration_s"] = round(report["finished_at"] - started, 3)
+            self.last_report = report
+            logger.info("Retention run on %s: %s", self.db_name, report)
+            return report
+
+    def run_forever(self, interval: float):
+        # The first run waits a full interval so starting the app never pays for one
+        while True:
+            time.sleep(interval)
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Retention run on %s failed", self.db_name)
+
+
+def enable_incremental_vacuum(db_name: str = "memory_palace.db") -> int:
+    """Switch an existing database file to incremental auto-vacuum and return the bytes reclaimed.
+
+    The switch rewrites the whole file with VACUUM, which blocks every writer
+    until it finishes, so it is a maintenance step to run while the app is
+    stopped rather than part of the background runs.
+    """
+    conn = connect(db_name)
+    try:
+        before = RetentionManager.file_size(conn)
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != INCREMENTAL:
+            conn.execute("VACUUM")
+        return before - RetentionManager.file_size(conn)
+    finally:
+        conn.close()
+
+
+_managers: Dict[str, RetentionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def start_retention(db_name: str = "memory_palace.db", interval: float = RETENTION_INTERVAL) -> RetentionManager:
+    """Start the background retention thread for db_name once per process and return its manager."""
+    key = os.path.abspath(db_name)
+    with _managers_lock:
+        if key not in _managers:
+            manager = RetentionManager(db_name)
+            _managers[key] = manager
+            threading.Thread(target=manager.run_forever, args=(interval,), name="session-retention",
+                             daemon=True).start()
+        return _managers[key]
+
+
+def get_retention_reports() -> List[Dict]:
+    return [manager.last_report for manager in _managers.values() if manager.last_report]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Expire idle sessions and compact the database file.")
+    parser.add_argument("--db", default="memory_palace.db", help="database file")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="first convert a file created before incremental auto-vacuum; stop the app meanwhile")
+    args = parser.parse_args(argv)
+
+    if args.enable_incremental_vacuum:
+        print(f"Converted {args.db}, reclaiming {enable_incremental_vacuum(args.db)} bytes")
+    print(RetentionManager(args.db).run_once())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from llm_cache import CACHE_PATH, CACHE_TTL_SECONDS
+
+# Cosine similarity from which a stored topic answers for a new one
+SIMILARITY_THRESHOLD = float(os.environ.get("MEMORY_PALACE_SEMANTIC_THRESHOLD", "0.6"))
+SEMANTIC_MAX_ENTRIES = int(os.environ.get("MEMORY_PALACE_SEMANTIC_MAX_ENTRIES", "2000"))
+# Width of the hashed feature vectors; 1024 float32 columns keep a full index under 10MB
+DIMENSIONS = 1024
+# Bumped whenever topic_features changes, so vectors saved before are embedded again on load
+FEATURES_VERSION = 3
+
+NUMBER_WORDS = {
+    "one": "1", "first": "1",
+    "two": "2", "second": "2",
+    "three": "3", "third": "3",
+    "four": "4", "fourth": "4",
+    "five": "5", "fifth": "5",
+}
+STOP_WORDS = {"a", "an", "and", "the", "of", "in", "on", "to", "for", "about"}
+# Roman numerals up to 89, as in regnal names and sequels; in capitals, or in lower case when only i, v and x
+ROMAN_NUMERAL = re.compile(r"(?=[IVXL])(XL|L?X{0,3})(IX|IV|V?I{0,3})$")
+ROMAN_VALUES = {"I": 1, "V": 5, "X": 10, "L": 50}
+# Shortest words that count as spellings of one word when a single letter differs
+RESPELLED_LENGTH = 5
+
+
+def roman_to_number(token: str) -> Optional[str]:
+    """The digits of a roman numeral token, or None when it is a word."""
+    if not (token.isupper() or re.fullmatch(r"[ivx]+", token)) or not ROMAN_NUMERAL.match(token.upper()):
+        return None
+    values = [ROMAN_VALUES[letter] for letter in token.upper()]
+    return str(sum(-value if value < following else value
+                   for value, following in zip(values, values[1:] + [0])))
+
+
+def topic_tokens(topic: str) -> List[Tuple[str, bool]]:
+    """Lowercase word and number tokens, each with whether it was written as an acronym.
+
+    Number words and roman numerals are spelled as digits, dotted initials
+    such as "U.S." are read as one acronym, and trailing + and # stay on their
+    word so "C++" and "C#" remain different names.
+    """
+    text = unicodedata.normalize("NFKD", topic).encode("ascii", "ignore").decode()
+    text = re.sub(r"\b(?:[A-Z]\.\s?){2,}", lambda match: re.sub(r"[.\s]", "", match.group()) + " ", text)
+    tokens = []
+    for token in re.findall(r"[A-Za-z]+[+#]*|\d+", text):
+        lowered = token.lower()
+        if lowered in STOP_WORDS:
+            continue
+        number = token if token.isdigit() else NUMBER_WORDS.get(lowered) or roman_to_number(token)
+        tokens.append((number, False) if number else (lowered, len(token) > 1 and token.isalpha() and token.isupper()))
+    return tokens
+
+
+def trigrams(token: str) -> List[str]:
+    padded = f"#{token}#"
+    return [padded[i:i + 3] for i in range(max(1, len(padded) - 2))]
+
+
+def initials(tokens: List[Tuple[str, bool]]) -> str:
+    """First letters of the words in order, with an acronym contributing all of its letters."""
+    return "".join(token if acronym else token[0] for token, acronym in tokens if not token.isdigit())
+
+
+def _spans(length: int, shortest: int = 2) -> Iterator[Tuple[int, int]]:
+    """(start, end) of every run of at least shortest consecutive tokens."""
+    return ((start, end) for start in range(length) for end in range(start + shortest, length + 1))
+
+
+def topic_features(topic: str) -> Dict[str, float]:
+    """Weighted features of a topic: its words, their character trigrams and its initials.
+
+    Trigrams absorb spelling variants, and the initials let an acronym such as
+    "WW1" meet its expansion "World War I". Initials keep the order of the
+    words and of an acronym's letters.
+    """
+    tokens = topic_tokens(topic)
+    features: Dict[str, float] = {}
+    for token, _ in tokens:
+        features[f"w:{token}"] = features.get(f"w:{token}", 0.0) + 1.0
+        token_trigrams = trigrams(token)
+        for trigram in token_trigrams:
+            features[f"c:{trigram}"] = features.get(f"c:{trigram}", 0.0) + 1.0 / len(token_trigrams)
+    # Initials of every run of words, in order, so a reordered topic still shares some of them.
+    # They carry the same total weight however many runs a topic has.
+    words = [word for word in tokens if not word[0].isdigit()]
+    runs = {letters for start, end in _spans(len(words), shortest=1) if len(letters := initials(words[start:end])) > 1}
+    for letters in runs:
+        features[f"i:{letters}"] = 2.0 / len(runs) ** 0.5
+    return features
+
+
+def _one_edit_apart(first: str, second: str) -> bool:
+    """Whether inserting, deleting or replacing at most one letter turns first into second."""
+    if len(first) > len(second):
+        first, second = second, first
+    if len(second) - len(first) > 1:
+        return False
+    for index, (letter, other) in enumerate(zip(first, second)):
+        if letter != other:
+            return first[index + (len(first) == len(second)):] == second[index + 1:]
+    return True
+
+
+def _respelled(word: str, others: Set[str]) -> bool:
+    # Short words one letter apart are usually different words, as are longer ones two letters apart,
+    # such as "Austrian" and "Australian"
+    return len(word) >= RESPELLED_LENGTH and any(len(other) >= RESPELLED_LENGTH and _one_edit_apart(word, other)
+                                                 for other in others)
+
+
+def _accounts_for(tokens: List[Tuple[str, bool]], other: List[Tuple[str, bool]]) -> bool:
+    """Whether every word of tokens is in other as itself, as a variant spelling, or through an acronym."""
+    words = [word for word in tokens if not word[0].isdigit()]
+    other_words = [word for word in other if not word[0].isdigit()]
+    other_names = {token for token, _ in other_words}
+    other_acronyms = {token for token, acronym in other_words if acronym}
+    # Acronyms other spells out in words, and words of tokens that an acronym of other stands for
+    other_spelled = {initials(other_words[start:end]) for start, end in _spans(len(other_words))}
+    abbreviated = {index for start, end in _spans(len(words)) if initials(words[start:end]) in other_acronyms
+                   for index in range(start, end)}
+    return all(token in other_names or index in abbreviated or (acronym and token in other_spelled)
+               or _respelled(token, other_names)
+               for index, (token, acronym) in enumerate(words))
+
+
+def same_topic(first: str, second: str) -> bool:
+    """Whether two similar topics name the same thing rather than neighbours such as "Apollo 11" and "Apollo 13".
+
+    Their numbers must match exactly, and every word of each must be accounted
+    for by the other, so "Causes of World War 1" never answers for
+    "Consequences of World War 1".
+    """
+    first_tokens, second_tokens = topic_tokens(first), topic_tokens(second)
+    if sorted(t for t, _ in first_tokens if t.isdigit()) != sorted(t for t, _ in second_tokens if t.isdigit()):
+        return False
+    return _accounts_for(first_tokens, second_tokens) and _accounts_for(second_tokens, first_tokens)
+
+
+def embed(topic: str) -> np.ndarray:
+    """Unit-length hashed feature vector of a topic."""
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    for feature, weight in topic_features(topic).items():
+        digest = zlib.crc32(feature.encode("utf-8"))
+        # The sign bit keeps colliding features from always adding up
+        vector[digest % DIMENSIONS] += weight if digest & 0x80000000 else -weight
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticTopicCache:
+    """Nearest-neighbour cache of LLM responses keyed by topic similarity.
+
+    Vectors live in one NumPy matrix, saved with the topics and responses to an
+    .npz file next to the LLM response cache. Entries are grouped by namespace
+    (the model, temperature and prompt template) so only responses to the same
+    prompt are ever reused.
+    """
+
+    def __init__(self, path: str, threshold: float = SIMILARITY_THRESHOLD,
+                 max_entries: int = SEMANTIC_MAX_ENTRIES, ttl_seconds: float = CACHE_TTL_SECONDS):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.vectors = np.zeros((0, DIMENSIONS), dtype=np.float32)
+        self.entries: List[Dict] = []
+        self.hits = self.misses = 0
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with np.load(self.path) as data:
+            self.vectors = data["vectors"]
+            self.entries = json.loads(str(data["entries"]))
+            features_version = int(data["features_version"]) if "features_version" in data else 1
+        if features_version != FEATURES_VERSION:
+            # Saved by an older topic_features; embed the topics again so they compare with new ones
+            self.vectors = np.array([embed(entry["topic"]) for entry in self.entries],
+                                    dtype=np.float32).reshape(-1, DIMENSIONS)
+
+    def save(self):
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path, vectors=self.vectors, entries=np.array(json.dumps(self.entries)),
+                 features_version=np.array(FEATURES_VERSION))
+        os.replace(tmp_path, self.path)
+
+    def lookup(self, namespace: str, topic: str) -> Optional[Tuple[str, str, float]]:
+        """Return (stored topic, response, similarity) of the closest fresh topic above the threshold.
+
+        A similar topic only answers when same_topic agrees it names the same thing.
+        """
+        query = embed(topic)
+        oldest = time.time() - self.ttl_seconds
+        with self.lock:
+            if self.entries:
+                scores = self.vectors @ query
+                for index in np.argsort(-scores):
+                    if scores[index] < self.threshold:
+                        break
+                    entry = self.entries[index]
+                    if entry["namespace"] == namespace and entry["created_at"] >= oldest \
+                            and same_topic(topic, entry["topic"]):
+                        self.hits += 1
+                        return entry["topic"], entry["response"], float(scores[index])
+            self.misses += 1
+        return None
+
+    def add(self, namespace: str, topic: str, response: str):
+        vector = embed(topic)
+        now = time.time()
+        with self.lock:
+            # Keep one entry per topic and namespace, and drop expired and surplus entries, oldest first
+            keep = [index for index, entry in enumerate(self.entries)
+                    if entry["created_at"] >= now - self.ttl_seconds
+                    and (entry["namespace"], entry["topic"]) != (namespace, topic)]
+            keep = keep[len(keep) - self.max_entries + 1:] if len(keep) >= self.max_entries else keep
+            self.entries = [self.entries[index] for index in keep]
+            self.entries.append({"namespace": namespace, "topic": topic, "response": response, "created_at": now})
+            self.vectors = np.vstack([self.vectors[keep], vector[np.newaxis, :]])
+            self.save()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+    def clear(self):
+        with self.lock:
+            self.vectors = np.zeros((0, DIMENSIONS), dtype=np.float32)
+            self.entries = []
+            self.save()
+
+
+_shared_caches: Dict[str, SemanticTopicCache] = {}
+_shared_lock = threading.Lock()
+
+
+def get_semantic_cache(path: str = os.path.splitext(CACHE_PATH)[0] + ".topics.npz") -> SemanticTopicCache:
+    """Return the process-wide semantic topic cache stored at path."""
+    with _shared_lock:
+        if path not in _shared_caches:
+            _shared_caches[path] = SemanticTopicCache(path)
+        return _shared_caches[path]
@@ -0,0 +1,74 @@
+import os
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+# Seconds a caller waits for an identical call already in flight before giving up
+WAIT_TIMEOUT = float(os.environ.get("MEMORY_PALACE_LLM_WAIT_TIMEOUT", "120"))
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one call.
+
+    The first caller for a key (the leader) runs the call; callers arriving
+    while it is in flight wait for the leader's result, or its exception,
+    instead of making a call of their own.
+    """
+
+    def __init__(self):
+        self.flights: Dict[Hashable, Future] = {}
+        self.lock = threading.Lock()
+        self.counts = {"calls": 0, "shared": 0, "errors": 0, "timeouts": 0}
+
+    def begin(self, key: Hashable) -> Tuple[Future, bool]:
+        """Return the flight for key and whether the caller is its leader and must finish() it."""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                self.counts["shared"] += 1
+                return flight, False
+            flight = Future()
+            self.flights[key] = flight
+            self.counts["calls"] += 1
+            return flight, True
+
+    def finish(self, key: Hashable, flight: Future, result: Any = None, error: BaseException = None):
+        """Publish the leader's outcome to every waiter; later callers start a new flight."""
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            if error is not None:
+                self.counts["errors"] += 1
+        if error is not None:
+            flight.set_exception(error)
+        else:
+            flight.set_result(result)
+
+    def wait(self, flight: Future, timeout: float = WAIT_TIMEOUT) -> Any:
+        try:
+            return flight.result(timeout)
+        except FutureTimeoutError:
+            with self.lock:
+                self.counts["timeouts"] += 1
+            raise TimeoutError(f"Identical request still in flight after {timeout}s")
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: float = WAIT_TIMEOUT) -> Any:
+        """Return fn(), sharing the call with every concurrent caller using the same key."""
+        flight, leader = self.begin(key)
+        if not leader:
+            return self.wait(flight, timeout)
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counts, in_flight=len(self.flights))
+
+
+# Shared by every session of the process, which is where identical prompts meet
+llm_flights = SingleFlight()
@@ -1,11 +1,12 @@
-import openai
 import streamlit as st
-from langchain import PromptTemplate, LLMChain, OpenAI
 
 # Replace with your OpenAI API key
 #from secretkeys import openapi_key
 import os
 from pages import usertopic
+from llm_cache import get_llm_cache
+from llm_operations import LLMClient, openai_llm, predict_topic_with_metrics, predict_with_metrics, run_concurrently
+from semantic_cache import get_semantic_cache
 
 hide_default_format = """
        <style>
@@ -17,7 +18,17 @@ hide_default_format = """
 #openai_api_key = st.secrets["OPENAI_API_KEY"]
 openai_api_key = st.sidebar.text_input('OpenAI API Key')
 
-llm = OpenAI(temperature=0.6, openai_api_key=openai_api_key)
+bypass_cache = st.sidebar.checkbox('Bypass response cache')
+
+
+@st.cache_resource(show_spinner=False)
+def get_llm(openai_api_key, temperature):
+    # Built lazily, so the LLM stack is only imported once a prompt is sent
+    return openai_llm(openai_api_key, temperature)
+
+
+llm = LLMClient(get_llm(openai_api_key, 0.6), get_llm_cache(), bypass_cache=bypass_cache,
+                semantic_cache=get_semantic_cache())
 # Initialize empty lists for items before and after the dash
 
 st.markdown(hide_default_format, unsafe_allow_html=True)
@@ -39,17 +50,12 @@ number_choice = st.number_input(r"$\textsf{\Large Enter number of Main points (5
 number_choice = int(number_choice)
 topic = st.text_input(r"$\textsf{\Large Enter the topic you want to learn about (i.e. World War 1):}$", max_chars=50)
 
-# Define the prompt templates
-topic_prompt = PromptTemplate(
-    input_variables=["topic"],
-    template=f"Provide {number_choice} important bullet points about {topic}:"
-)
-
-# Define the chains
-topic_chain = LLMChain(llm=llm, prompt=topic_prompt)
+# Define the prompt templates; the number of points is part of the template, so similar topics
+# only share points retrieved for the same number
+topic_template = f"Provide {number_choice} important bullet points about {{topic}}:"
 
 def get_topic_info(topic):
-    response = topic_chain.run({"topic": topic})
+    response = predict_topic_with_metrics(llm, topic, topic_template)
     points = response.strip().split('\n')
     return [point.strip('- ') for point in points if point.strip()]
 
@@ -58,7 +64,7 @@ def get_memorable_imagery(item, info):
     Using the memory palace method, create a succinct, vivid and memorable mental imagery to associate the phrase '{info}' with the item '{item}':
     Make the associations interesting, obvious and brief.
     """
-    response = llm.predict(prompt)
+    response = predict_with_metrics(llm, prompt, "get_memorable_imagery")
     return response
 
 def main():
@@ -72,7 +78,13 @@ def main():
         st.write("\nAssociating...")
         bullet_points = get_topic_info(topic)
         st.write("\nGenerating memorable mental imagery with your palace items...")
-        imagery_list = [get_memorable_imagery(items[i], bullet_points[i]) for i in range(number_choice)]
+        results = run_concurrently(get_memorable_imagery, list(zip(items, bullet_points)))
+        imagery_list = []
+        for item, (imagery, error) in zip(items, results):
+            if error is not None:
+                st.error(f"Error getting memorable imagery for '{item}': {str(error)}")
+                imagery = "N/A"
+            imagery_list.append(imagery)
         st.write(f"\nInformation saved to {filename}")
         st.write(f"\nHere are the important points associated with {topic}:")
         st.markdown(f"**Memory Palace: {full_palace_name}**")
@@ -0,0 +1,168 @@
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from db_connection import connect, get_connection_manager
+
+logger = logging.getLogger(__name__)
+
+# Route DatabaseOperations writes through the group-commit writer
+WRITE_BEHIND = os.environ.get("MEMORY_PALACE_WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+# A group is committed once it holds this many writes or its first write has waited this long.
+# With no delay a group is whatever queued up while the previous group was committing.
+GROUP_MAX_WRITES = int(os.environ.get("MEMORY_PALACE_GROUP_MAX_WRITES", "64"))
+GROUP_MAX_DELAY = float(os.environ.get("MEMORY_PALACE_GROUP_MAX_DELAY", "0"))
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """A single writer thread that commits queued writes in groups.
+
+    Each write is a callable run on the writer thread, where the connection
+    pool hands it the writer's own connection. Writes run in submission order
+    inside one transaction per group, each under its own savepoint so a failing
+    write is rolled back alone. That connection syncs every commit to disk, and
+    a write's future resolves only after its group is committed, so a caller
+    waiting on it knows the write is durable.
+    """
+
+    def __init__(self, db_name: str, max_writes: int = GROUP_MAX_WRITES, max_delay: float = GROUP_MAX_DELAY):
+        self.db_name = db_name
+        self.connections = get_connection_manager(db_name)
+        self.max_writes = max_writes
+        self.max_delay = max_delay
+        self.queue: "queue.Queue" = queue.Queue()
+        self.closed = False
+        self.lock = threading.Lock()
+        self.counts = {"writes": 0, "groups": 0, "failed_writes": 0}
+        self.conn: Optional[sqlite3.Connection] = None
+        self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def submit(self, write: Callable[[], Any]) -> Future:
+        """Queue write and return a future for its result, set once the write is committed."""
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("Write-behind queue is closed")
+            self.queue.put((write, future))
+        return future
+
+    def flush(self, timeout: Optional[float] = None):
+        """Wait until every write submitted so far is committed."""
+        self.submit(lambda: None).result(timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        """Commit the queued writes, then stop the writer thread."""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+    def _next_group(self) -> Tuple[List[Tuple[Callable[[], Any], Future]], bool]:
+        first = self.queue.get()
+        if first is _STOP:
+            return [], True
+        group = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(group) < self.max_writes:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return group, True
+            group.append(item)
+        return group, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            group, stop = self._next_group()
+            if group:
+                self._commit_group(group)
+        if self.conn is not None:
+            self.conn.close()
+
+    def _writer_connection(self) -> sqlite3.Connection:
+        if self.conn is None:
+            conn = connect(self.db_name)
+            # Sync the WAL on every commit rather than at checkpoints: one fsync per group, which
+            # group commit spreads across its writes, in exchange for commits surviving power loss
+            conn.execute("PRAGMA synchronous = FULL")
+            self.conn = conn
+        return self.conn
+
+    def _commit_group(self, group: List[Tuple[Callable[[], Any], Future]]):
+        outcomes = []
+        try:
+            conn = self._writer_connection()
+            # The writes borrow this connection through the pool while the group runs
+            with self.connections.lend(conn):
+                conn.execute("BEGIN IMMEDIATE")
+                for write, future in group:
+                    conn.execute("SAVEPOINT write")
+                    try:
+                        result = write()
+                        if isinstance(result, sqlite3.Cursor):
+                            # Freed on the caller's thread it would reset a statement this thread is reusing
+                            raise TypeError("A write-behind write returned a cursor; return lastrowid or rowcount")
+                        outcomes.append((future, result, None))
+                        conn.execute("RELEASE write")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO write")
+                        conn.execute("RELEASE write")
+                        outcomes.append((future, None, e))
+                conn.commit()
+        except Exception as e:
+            logger.exception("Write-behind group of %d writes failed", len(group))
+            if self.conn is not None and self.conn.in_transaction:
+                self.conn.rollback()
+            for _, future in group:
+                future.set_exception(e)
+            return
+        with self.lock:
+            self.counts["groups"] += 1
+            self.counts["writes"] += len(group)
+            self.counts["failed_writes"] += sum(1 for _, _, error in outcomes if error is not None)
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counts, queued=self.queue.qsize())
+
+
+_queues: Dict[str, WriteBehindQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_write_queue(db_name: str = "memory_palace.db") -> WriteBehindQueue:
+    """Return the process-wide write-behind queue for db_name, starting its writer on first use."""
+    key = os.path.abspath(db_name)
+    with _queues_lock:
+        if key not in _queues or _queues[key].closed:
+            _queues[key] = WriteBehindQueue(db_name)
+        return _queues[key]
+
+
+@atexit.register
+def close_write_queues():
+    """Commit whatever is still queued before the process exits."""
+    with _queues_lock:
+        queues = list(_queues.values())
+    for write_queue in queues:
+        write_queue.close()